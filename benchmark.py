@@ -0,0 +1,603 @@
+"""
+Benchmarks for multisudoku server
+Run: python benchmark.py rpc --clients 1,2,4,8,16 --workers 0,8
+     python benchmark.py generate --complexity 1,5,10 --count 20
+     python benchmark.py longpoll --waiters 10,100,500
+     python benchmark.py framing --sizes 16,256,4096 --count 2000
+     python benchmark.py codec --count 20000
+     python benchmark.py latency --clients 1,4,32 --count 2000
+     python benchmark.py guess --count 2000
+     python benchmark.py render --count 2000
+     python benchmark.py suite --output new.json
+     python benchmark.py compare old.json new.json --threshold 0.1
+"""
+import argparse
+from functools import partial
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pickle
+import xmlrpclib
+from xmlrpclib import ServerProxy, Transport, MultiCall
+
+from protocol import *
+from client import KeepAliveTransport
+from harness import start_server, stop_server, percentile, NullIO
+import client as c
+import sudoku as su
+
+logging.disable(logging.INFO)
+
+BENCH_HOST = '127.0.0.1'
+BENCH_PORT = 17777
+
+
+def stall_connection(port):
+    """
+    Open connection and send incomplete request, the way a slow client does
+    :return: socket, keep it open while measuring
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((BENCH_HOST, port))
+    sock.sendall('POST /RPC2 HTTP/1.0\r\n')
+    return sock
+
+
+def rpc_client_loop(port, deadline, counts, i):
+    proxy = ServerProxy('http://%s:%d' % (BENCH_HOST, port))
+    n = 0
+    while time.time() < deadline:
+        proxy.get_current_state(DEFAULT_ROOM)
+        n += 1
+    counts[i] = n
+
+
+def bench_rpc(args):
+    """
+    Requests per second served with growing number of concurrent clients
+    """
+    clients = [int(c) for c in args.clients.split(',')]
+    workers = [int(w) for w in args.workers.split(',')]
+    print '%8s %8s %8s %12s' % ('workers', 'clients', 'stalled', 'requests/s')
+    port = args.port
+    for w in workers:
+        for c in clients:
+            server = start_server(port, w)
+            stalled = [stall_connection(port) for _ in range(args.stalled)]
+            counts = [0] * c
+            deadline = time.time() + args.duration
+            threads = [threading.Thread(target=rpc_client_loop, args=(port, deadline, counts, i))
+                       for i in range(c)]
+            for t in threads:
+                t.daemon = True
+                t.start()
+            # Stalled connections block single-threaded server, do not wait forever
+            for t in threads:
+                t.join(args.duration + 1)
+            for sock in stalled:
+                sock.close()
+            for t in threads:
+                t.join()
+            print '%8d %8d %8d %12.1f' % (w, c, args.stalled, sum(counts) / args.duration)
+            stop_server(server)
+            # Fresh port for every run, the old one can linger in TIME_WAIT
+            port += 1
+
+
+def bench_generate(args):
+    """
+    Puzzles per second of the built-in engine and of edsudoku
+    """
+    generators = [('native', su.generate)]
+    if su.edsudoku is not None:
+        generators.append(('edsudoku', su.get_edsudoku))
+    else:
+        print 'edsudoku is not installed, measuring the built-in engine only'
+    print '%10s %10s %8s %12s' % ('engine', 'complexity', 'clues', 'puzzles/s')
+    for c in [int(c) for c in args.complexity.split(',')]:
+        for name, generate in generators:
+            clues = 0
+            start = time.time()
+            for _ in range(args.count):
+                clues += sum(1 for v in generate(c)['u'] if v)
+            elapsed = time.time() - start
+            print '%10s %10d %8.1f %12.1f' % (name, c, float(clues) / args.count, args.count / elapsed)
+
+
+def longpoll_waiter(port, version, woken, i):
+    proxy = ServerProxy('http://%s:%d' % (BENCH_HOST, port))
+    proxy.wait_for_update(DEFAULT_ROOM, version, DEFAULT_LONGPOLL_TIMEOUT)
+    woken[i] = time.time()
+
+
+def bench_longpoll(args):
+    """
+    Many clients parked in wait_for_update: throughput of other requests
+    while they wait and time to wake all of them up on a state change
+    """
+    threading.stack_size(256 * 1024)
+    print '%8s %8s %12s %12s %12s' % ('waiters', 'threads', 'requests/s', 'wake p50 ms', 'wake max ms')
+    port = args.port
+    for n in [int(w) for w in args.waiters.split(',')]:
+        server = start_server(port, DEFAULT_RPC_WORKERS)
+        game = server.rooms.get_room(DEFAULT_ROOM)
+        version = game.get_changes(-1)['version']
+        woken = [None] * n
+        waiters = [threading.Thread(target=longpoll_waiter, args=(port, version, woken, i)) for i in range(n)]
+        for t in waiters:
+            t.daemon = True
+            t.start()
+        # Let all of them park
+        deadline = time.time() + 10
+        while server.server.parked_workers()[1] < n and time.time() < deadline:
+            time.sleep(0.05)
+        threads = server.server.parked_workers()[0]
+
+        # Other requests go on while they wait
+        clients = 4
+        counts = [0] * clients
+        stop = time.time() + args.duration
+        loops = [threading.Thread(target=rpc_client_loop, args=(port, stop, counts, i)) for i in range(clients)]
+        for t in loops:
+            t.start()
+        for t in loops:
+            t.join()
+
+        start = time.time()
+        game.check_name('wake')
+        for t in waiters:
+            t.join()
+        latencies = sorted((w - start) * 1000 for w in woken)
+        print '%8d %8d %12.1f %12.1f %12.1f' % (n, threads, sum(counts) / args.duration,
+                                                latencies[len(latencies) // 2], latencies[-1])
+        stop_server(server)
+        port += 1
+
+
+def read_separated(sock):
+    """
+    Old session reader: one recv per byte until MSG_SEP
+    """
+    m, b = '', ''
+    b = sock.recv(1)
+    m += b
+    while len(b) > 0 and not b.endswith(MSG_SEP):
+        b = sock.recv(1)
+        m += b
+    return m[:-1] if b else None
+
+
+def framing_writer(sock, data):
+    sock.sendall(data)
+
+
+def bench_framing(args):
+    """
+    Messages and megabytes per second received over a local socket by the old
+    separator reader and by the length-prefixed FrameReader
+    """
+    print '%10s %8s %12s %12s' % ('reader', 'size', 'messages/s', 'MB/s')
+    for size in [int(n) for n in args.sizes.split(',')]:
+        message = 'x' * size
+        # Name, stream of count messages, reader of one message from socket
+        streams = [('separator', ''.join(message + MSG_SEP for _ in range(args.count)),
+                    lambda sock: partial(read_separated, sock)),
+                   ('frames', pack_frames(*([message] * args.count)),
+                    lambda sock: FrameReader(sock).read)]
+        for name, data, reader in streams:
+            left, right = socket.socketpair()
+            read = reader(right)
+            writer = threading.Thread(target=framing_writer, args=(left, data))
+            writer.daemon = True
+            start = time.time()
+            writer.start()
+            for _ in range(args.count):
+                assert read() == message
+            elapsed = time.time() - start
+            writer.join()
+            left.close()
+            right.close()
+            print '%10s %8d %12.1f %12.2f' % (name, size, args.count / elapsed,
+                                              args.count * size / elapsed / 1e6)
+
+
+def codec_samples():
+    """
+    One value of every session message: message code, value, value expected back
+    """
+    board = su.generate(5)['u']
+    scores = dict(('player%d' % i, 10 * i - 5) for i in range(DEFAULT_LEADERBOARD_SIZE))
+    return [(REQ_GM_SET_NAME, u'player', u'player'),
+            (REQ_GM_SET_SUDOKU, 5, 5),
+            (REQ_GM_GUESS, (7, 4, 8), (7, 4, 8)),
+            (REQ_GM_GET_STATE, None, None),
+            (RSP_GM_STATE, (board, sorted(scores.items())),
+             (board.cells, [[n, p] for n, p in sorted(scores.items())])),
+            (RSP_GM_NOTIFY, u'player2 guessed 7 on [4][8] \u2713', u'player2 guessed 7 on [4][8] \u2713')]
+
+
+def bench_codec(args):
+    """
+    Round trip of session messages: binary codec against pickle and XML-RPC marshalling
+    """
+    samples = codec_samples()
+    codecs = [('codec', serialize, deserialize),
+              ('pickle', lambda kind, v: pickle.dumps(v, pickle.HIGHEST_PROTOCOL),
+               lambda kind, p: pickle.loads(p)),
+              ('xmlrpc', lambda kind, v: xmlrpclib.dumps((v,)),
+               lambda kind, p: xmlrpclib.loads(p)[0][0])]
+    print '%10s %8s %8s %12s' % ('message', 'codec', 'bytes', 'trips/s')
+    for kind, sample, _ in samples:
+        for name, dumps, loads in codecs:
+            value = sample
+            # Other formats get what they can marshal, board as raw bytes
+            if name == 'pickle' and kind == RSP_GM_STATE:
+                value = (sample[0].tobytes(), sample[1])
+            elif name == 'xmlrpc' and kind == RSP_GM_STATE:
+                value = (xmlrpclib.Binary(sample[0].tobytes()), sample[1])
+            elif name == 'xmlrpc' and sample is None:
+                value = ''
+            payload = dumps(kind, value)
+            start = time.time()
+            for _ in range(args.count):
+                loads(kind, dumps(kind, value))
+            elapsed = time.time() - start
+            print '%10s %8s %8d %12.1f' % (CODEC_NAMES[kind], name, len(payload), args.count / elapsed)
+
+
+CODEC_NAMES = {REQ_GM_SET_NAME: 'set_name', REQ_GM_SET_SUDOKU: 'set_sudoku',
+               REQ_GM_GUESS: 'guess', REQ_GM_GET_STATE: 'get_state',
+               RSP_GM_STATE: 'state', RSP_GM_NOTIFY: 'notify'}
+
+
+def latency_client_loop(port, transport, count, latencies, i):
+    proxy = ServerProxy('http://%s:%d' % (BENCH_HOST, port), transport=transport)
+    result = []
+    for _ in range(count):
+        start = time.time()
+        proxy.get_current_state(DEFAULT_ROOM)
+        result.append(time.time() - start)
+    latencies[i] = result
+
+
+def bench_latency(args):
+    """
+    Latency of a call with a new connection for every call (HTTP/1.0 server)
+    and with keep-alive connections, clients call one after another
+    """
+    print '%10s %8s %10s %10s %10s %12s' % ('transport', 'clients', 'p50 ms', 'p99 ms', 'max ms', 'calls/s')
+    port = args.port
+    for c in [int(c) for c in args.clients.split(',')]:
+        for name, keepalive, transport in [('new conn', False, Transport),
+                                           ('keepalive', True, KeepAliveTransport)]:
+            server = start_server(port, DEFAULT_RPC_WORKERS, keepalive)
+            latencies = [None] * c
+            threads = [threading.Thread(target=latency_client_loop,
+                                        args=(port, transport(), args.count, latencies, i))
+                       for i in range(c)]
+            start = time.time()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.time() - start
+            calls = sorted(l * 1000 for client in latencies for l in client)
+            print '%10s %8d %10.3f %10.3f %10.3f %12.1f' % (name, c, percentile(calls, 50),
+                                                            percentile(calls, 99), calls[-1],
+                                                            len(calls) / elapsed)
+            stop_server(server)
+            port += 1
+
+
+def guess_sequential(proxy, version):
+    """
+    Wrong guess the way the client did it before: guess, refresh after the
+    wrong answer, refresh again for the board
+    """
+    if not proxy.guess_number(DEFAULT_ROOM, 0, [0, 0], 'bench'):
+        version = proxy.get_changes(DEFAULT_ROOM, version)['version']
+    return proxy.get_changes(DEFAULT_ROOM, version)['version']
+
+
+def guess_multicall(proxy, version):
+    """
+    Guess and the changes it made in one request
+    """
+    batch = MultiCall(proxy)
+    batch.guess_number(DEFAULT_ROOM, 0, [0, 0], 'bench')
+    batch.get_changes(DEFAULT_ROOM, version)
+    return batch()[1]['version']
+
+
+def bench_guess(args):
+    """
+    Time of one guess from the client: separate calls against one multicall
+    """
+    print '%12s %12s %12s' % ('mode', 'ms/guess', 'guesses/s')
+    server = start_server(args.port, DEFAULT_RPC_WORKERS)
+    game = server.rooms.get_room(DEFAULT_ROOM)
+    game.check_name('bench')
+    game.set_new_sudoku('bench', 1)
+    for name, guess in [('sequential', guess_sequential), ('multicall', guess_multicall)]:
+        proxy = ServerProxy('http://%s:%d' % (BENCH_HOST, args.port), transport=KeepAliveTransport())
+        version = proxy.get_changes(DEFAULT_ROOM, -1)['version']
+        start = time.time()
+        for _ in range(args.count):
+            version = guess(proxy, version)
+        elapsed = time.time() - start
+        print '%12s %12.3f %12.1f' % (name, elapsed * 1000 / args.count, args.count / elapsed)
+    stop_server(server)
+
+
+class StubBox(object):
+    """
+    Stands for Tk Entry and its StringVar, counts the calls a redraw makes
+    """
+    calls = 0
+
+    def config(self, **options):
+        StubBox.calls += 1
+
+    def set(self, value):
+        StubBox.calls += 1
+
+    def trace(self, mode, callback):
+        StubBox.calls += 1
+
+    def trace_vdelete(self, mode, name):
+        StubBox.calls += 1
+
+
+def render_full(boxes, rendered, board):
+    """
+    Redraw the way SudokuFrame did before: drop the traces, reconfigure
+    every box, put the traces back
+    """
+    for b in boxes:
+        b.trace_vdelete('w', None)
+    for i, b in enumerate(boxes):
+        b.config(state='normal')
+        if board[i]:
+            b.set(board[i])
+            b.config(state='disabled')
+    for b in boxes:
+        b.trace('w', None)
+    return rendered
+
+
+def render_diff(boxes, rendered, board):
+    """
+    Redraw the way SudokuFrame does: only the boxes that changed
+    """
+    for i, v in rendered.diff(board):
+        b = boxes[i]
+        if v:
+            b.set(v)
+            b.config(state='disabled')
+        else:
+            b.config(state='normal')
+            b.set('')
+        rendered[i] = v
+    return rendered
+
+
+def bench_render(args):
+    """
+    Cost of a board redraw when one cell changes (a guess) and when all
+    of them do (a new game), without Tk: widget calls are counted by stubs
+    """
+    puzzle = su.generate(5)
+    solved, start = puzzle['s'], puzzle['u']
+    empty = [i for i in range(81) if not start[i]]
+    # Every update uncovers one more cell, then a new game starts over
+    updates = []
+    board = start.copy()
+    while len(updates) < args.count:
+        for i in empty:
+            board = board.copy()
+            board[i] = solved[i]
+            updates.append(('cell', board))
+        board = start.copy()
+        updates.append(('game', board))
+    updates = updates[:args.count]
+
+    print '%8s %8s %12s %12s' % ('redraw', 'update', 'calls', 'us/update')
+    for name, render in [('full', render_full), ('diff', render_diff)]:
+        boxes = [StubBox() for _ in range(81)]
+        rendered = start.copy()
+        # Update kind: [updates, widget calls, seconds]
+        totals = {'cell': [0, 0, 0.0], 'game': [0, 0, 0.0]}
+        for kind, board in updates:
+            calls = StubBox.calls
+            t = time.time()
+            rendered = render(boxes, rendered, board)
+            total = totals[kind]
+            total[2] += time.time() - t
+            total[1] += StubBox.calls - calls
+            total[0] += 1
+        for kind in ('cell', 'game'):
+            n, calls, elapsed = totals[kind]
+            print '%8s %8s %12.1f %12.2f' % (name, kind, float(calls) / n, elapsed * 1e6 / n)
+
+
+def measure(fn, number, repeat):
+    """
+    Call fn number times in a row, repeat such rounds
+    :return: dict, microseconds per call in the best and the median round
+    """
+    rounds = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in xrange(number):
+            fn()
+        rounds.append((time.time() - start) * 1e6 / number)
+    rounds.sort()
+    return {'min_us': rounds[0], 'median_us': rounds[len(rounds) // 2], 'number': number, 'repeat': repeat}
+
+
+def environment():
+    """
+    Where the results were taken, results of different machines do not compare
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': multiprocessing.cpu_count(),
+            'host': socket.gethostname(),
+            'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+
+def suite_cases(server, client):
+    """
+    Hot paths of the game
+    :return: list of (name, callable making one operation, calls per round)
+    """
+    game = server.rooms.get_room(DEFAULT_ROOM)
+    game.check_name('suite')
+    game.set_new_sudoku('suite', 5)
+    board = game.get_current_state()[0].data
+    # Clue cell: the right guess goes the whole way (score, change log, notification), board stays
+    i = next(i for i, v in enumerate(board) if v != '\0')
+    right, pos = ord(board[i]), [i // 9, i % 9]
+    wrong = right % 9 + 1
+
+    # New game goes on a room of its own, with a ready puzzle every time
+    server.rooms.create_room('suite')
+    room = server.rooms.get_room('suite')
+    puzzle = su.generate(5)
+
+    def new_sudoku():
+        room.reset('suite')
+        server.pool.put(5, puzzle)
+        room.set_new_sudoku('suite', 5)
+
+    state = game.get_current_state()
+    response = xmlrpclib.dumps((state,), methodresponse=True)
+    cases = [('game.guess_number.right', partial(game.guess_number, right, pos, 'suite'), 2000),
+             ('game.guess_number.wrong', partial(game.guess_number, wrong, pos, 'suite'), 2000),
+             ('game.get_current_state', game.get_current_state, 20000),
+             ('game.set_new_sudoku', new_sudoku, 1000),
+             ('sudoku.get_sudoku', partial(su.get_sudoku, 5), 10)]
+    for kind, value, _ in codec_samples():
+        payload = serialize(kind, value)
+        cases.append(('protocol.serialize.%s' % CODEC_NAMES[kind], partial(serialize, kind, value), 20000))
+        cases.append(('protocol.deserialize.%s' % CODEC_NAMES[kind], partial(deserialize, kind, payload), 20000))
+    cases += [('xmlrpc.dumps.state', partial(xmlrpclib.dumps, (state,), methodresponse=True), 2000),
+              ('xmlrpc.loads.state', partial(xmlrpclib.loads, response), 2000),
+              ('client.get_current_progress', client.get_current_progress, 20000),
+              ('client.get_current_progress.refresh', partial(client.get_current_progress, True), 500)]
+    return cases
+
+
+def bench_suite(args):
+    """
+    Every hot path in one run, results go to --output as JSON to compare later
+    """
+    # Same puzzles every run
+    random.seed(0)
+    server = start_server(args.port, DEFAULT_RPC_WORKERS)
+    client = c.Client(NullIO())
+    client.connect_proxy((BENCH_HOST, args.port))
+    client.set_my_name('suiteclient')
+    client.resync_interval = float('inf')
+    results = {}
+    try:
+        print '%40s %12s %12s' % ('case', 'min us', 'median us')
+        for name, fn, number in suite_cases(server, client):
+            if args.only and not name.startswith(args.only):
+                continue
+            results[name] = measure(fn, max(1, int(number * args.scale)), args.repeat)
+            print '%40s %12.2f %12.2f' % (name, results[name]['min_us'], results[name]['median_us'])
+    finally:
+        stop_server(server)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2, sort_keys=True)
+
+
+def bench_compare(args):
+    """
+    Compare two suite results: python benchmark.py compare old.json new.json
+    Exits with 1 if any case got slower than the threshold allows
+    """
+    if len(args.files) != 2:
+        raise SystemExit('compare needs two result files: old and new')
+    old, new = [json.load(open(name)) for name in args.files]
+    for key in ('python', 'implementation', 'machine', 'host'):
+        if old['environment'].get(key) != new['environment'].get(key):
+            print 'Warning: %s differs: %s vs %s' % (key, old['environment'].get(key), new['environment'].get(key))
+    regressions = 0
+    print '%40s %12s %12s %9s' % ('case', 'old us', 'new us', 'change')
+    for name in sorted(set(old['results']) | set(new['results'])):
+        if name not in old['results'] or name not in new['results']:
+            print '%40s %s' % (name, 'only in new' if name in new['results'] else 'only in old')
+            continue
+        before, after = old['results'][name]['min_us'], new['results'][name]['min_us']
+        change = after / before - 1 if before else 0.0
+        slower = change > args.threshold
+        regressions += slower
+        print '%40s %12.2f %12.2f %+8.1f%%%s' % (name, before, after, change * 100, '  REGRESSION' if slower else '')
+    if regressions:
+        print '%d regression(s) above %.0f%%' % (regressions, args.threshold * 100)
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    'rpc': bench_rpc,
+    'generate': bench_generate,
+    'longpoll': bench_longpoll,
+    'framing': bench_framing,
+    'codec': bench_codec,
+    'latency': bench_latency,
+    'guess': bench_guess,
+    'render': bench_render,
+    'suite': bench_suite,
+    'compare': bench_compare,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='multisudoku benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--clients', default='1,2,4,8,16,32',
+                        help='comma separated numbers of concurrent clients')
+    parser.add_argument('--workers', default='0,%d' % DEFAULT_RPC_WORKERS,
+                        help='comma separated numbers of RPC workers, 0 - single-threaded')
+    parser.add_argument('--stalled', type=int, default=0,
+                        help='number of slow clients holding a connection open')
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds to measure every configuration')
+    parser.add_argument('--port', type=int, default=BENCH_PORT)
+    parser.add_argument('--complexity', default='1,5,10',
+                        help='comma separated complexities of generated puzzles')
+    parser.add_argument('--count', type=int, default=20,
+                        help='puzzles to generate for every complexity, messages for framing and codec, calls per client for latency, guesses, board updates')
+    parser.add_argument('--waiters', default='10,100,500',
+                        help='comma separated numbers of clients waiting for update')
+    parser.add_argument('--sizes', default='16,256,4096',
+                        help='comma separated sizes of session messages in bytes')
+    parser.add_argument('--output', help='file to write suite results to, JSON')
+    parser.add_argument('--only', help='run suite cases starting with this prefix only')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds of every suite case')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of calls per suite round')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown of a suite case reported as regression, 0.1 - 10%%')
+    parser.add_argument('files', nargs='*', help='old and new suite results to compare')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
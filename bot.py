@@ -0,0 +1,187 @@
+"""
+Headless bots playing sudoku against a GameServer, to put load on it
+Run: python bot.py --address 127.0.0.1:7777 --players 16 --duration 30 --think 0.5 --accuracy 0.8
+     python bot.py --serve --players 64 --processes 4 --think 0
+"""
+import argparse
+import logging
+import random
+import threading
+import time
+from multiprocessing import Pool
+
+from protocol import *
+from harness import start_server, stop_server, percentile, NullIO
+import client as c
+import sudoku as su
+
+logging.disable(logging.INFO)
+
+
+class Bot:
+    """
+    Simulated player: picks an empty cell, guesses it right with
+    probability `accuracy` (the board is solved locally), thinks, repeats.
+    Starts a new game when the board is solved
+    """
+
+    def __init__(self, name, address, room=DEFAULT_ROOM, think=0.0, accuracy=1.0, complexity=5, rng=None):
+        """
+        :param address: tuple, (ip, port) of the server
+        :param think: float, mean seconds between guesses
+        :param accuracy: float, 0..1, share of right guesses
+        """
+        self.name = name
+        self.address = address
+        self.think = think
+        self.accuracy = accuracy
+        self.complexity = complexity
+        self.rng = rng or random.Random()
+        self.client = c.Client(NullIO())
+        self.client.room = room
+        self.solution = None
+
+        # Seconds every guess call took, wrong guesses, calls that failed
+        self.latencies = []
+        self.wrong = 0
+        self.errors = 0
+
+    def connect(self):
+        return self.client.connect_proxy(self.address) and self.client.set_my_name(self.name)
+
+    def __solution(self, board):
+        s = self.solution
+        if s is None or any(v and v != s[i] for i, v in enumerate(board)):
+            # New game
+            s = self.solution = su.solve(board)
+        return s
+
+    def step(self):
+        """
+        Make one guess, or start a new game if there is nothing to guess
+        """
+        board, _ = self.client.get_current_progress()
+        empty = [i for i, v in enumerate(board) if not v] if board is not None else []
+        if not empty:
+            self.client.set_new_sudoku_to_guess(self.complexity)
+            return
+        i = self.rng.choice(empty)
+        right = self.__solution(board)[i]
+        if self.rng.random() < self.accuracy:
+            num = right
+        else:
+            num = self.rng.choice([d for d in range(1, 10) if d != right])
+        start = time.time()
+        ok = self.client.guess_number('%d %d %d' % (num, i // 9, i % 9))
+        self.latencies.append(time.time() - start)
+        if not ok:
+            self.wrong += 1
+
+    def play(self, deadline):
+        while time.time() < deadline:
+            try:
+                self.step()
+            except Exception as e:
+                self.errors += 1
+                logging.error('%s: %s' % (self.name, e))
+            if self.think:
+                time.sleep(self.rng.uniform(0.5, 1.5) * self.think)
+
+
+def run_players(args, first, count):
+    """
+    Play count bots in threads of this process
+    :param first: int, number of the first bot, names are unique across processes
+    :return: dict, measurements of all bots together
+    """
+    address = parse_address(args.address)
+    bots = [Bot('bot%d' % (first + i), address, args.room, args.think, args.accuracy, args.complexity)
+            for i in range(count)]
+    connected = [b for b in bots if b.connect()]
+    deadline = time.time() + args.duration
+    threads = [threading.Thread(name=b.name, target=b.play, args=(deadline,)) for b in connected]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return {'players': len(connected),
+            'latencies': [l for b in connected for l in b.latencies],
+            'wrong': sum(b.wrong for b in connected),
+            'errors': sum(b.errors for b in connected) + len(bots) - len(connected)}
+
+
+def run_share(job):
+    return run_players(*job)
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+def run(args):
+    """
+    Run the bots, threads split over processes
+    :return: dict, report
+    """
+    shares = [args.players // args.processes + (1 if i < args.players % args.processes else 0)
+              for i in range(args.processes)]
+    jobs = [(args, sum(shares[:i]), n) for i, n in enumerate(shares) if n]
+    # Fork the processes before the local server starts its threads
+    pool = Pool(len(jobs)) if len(jobs) > 1 else None
+    server = start_server(parse_address(args.address)[1], args.workers) if args.serve else None
+    try:
+        start = time.time()
+        results = pool.map(run_share, jobs) if pool else [run_share(job) for job in jobs]
+        elapsed = time.time() - start
+    finally:
+        if pool:
+            pool.close()
+        if server:
+            stop_server(server)
+    latencies = sorted(l for r in results for l in r['latencies']) or [0.0]
+    guesses = sum(len(r['latencies']) for r in results)
+    wrong = sum(r['wrong'] for r in results)
+    return {'players': sum(r['players'] for r in results),
+            'guesses': guesses,
+            'guesses_per_s': guesses / elapsed,
+            'wrong_rate': float(wrong) / guesses if guesses else 0.0,
+            'errors': sum(r['errors'] for r in results),
+            'latency_p50_ms': percentile(latencies, 50) * 1000,
+            'latency_p95_ms': percentile(latencies, 95) * 1000,
+            'latency_p99_ms': percentile(latencies, 99) * 1000}
+
+
+def print_report(report):
+    print '%8s %10s %10s %8s %8s %10s %10s %10s' % ('players', 'guesses', 'guesses/s', 'wrong %', 'errors',
+                                                     'p50 ms', 'p95 ms', 'p99 ms')
+    print '%8d %10d %10.1f %8.1f %8d %10.2f %10.2f %10.2f' % (report['players'], report['guesses'],
+                                                             report['guesses_per_s'],
+                                                             report['wrong_rate'] * 100, report['errors'],
+                                                             report['latency_p50_ms'],
+                                                             report['latency_p95_ms'],
+                                                             report['latency_p99_ms'])
+
+
+def add_arguments(parser):
+    parser.add_argument('--address', default='127.0.0.1:%d' % DEFAULT_HOSTING_PORT,
+                        help='server to play on, ip:port')
+    parser.add_argument('--room', default=DEFAULT_ROOM)
+    parser.add_argument('--serve', action='store_true',
+                        help='start a server on the address port in this process')
+    parser.add_argument('--workers', type=int, default=DEFAULT_RPC_WORKERS,
+                        help='RPC workers of the server started with --serve')
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes to split the players over')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to play')
+    parser.add_argument('--think', type=float, default=0.1, help='mean seconds between guesses of a player')
+    parser.add_argument('--accuracy', type=float, default=0.8, help='share of right guesses, 0..1')
+    parser.add_argument('--complexity', type=int, default=5, help='complexity of new games')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='multisudoku load generator')
+    add_arguments(parser)
+    print_report(run(parser.parse_args()))
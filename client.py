@@ -1,14 +1,19 @@
 from tempfile import mktemp
-from threading import Thread, Condition, Lock
+from threading import Thread, Condition, Lock, RLock, Event
 from socket import AF_INET, SOCK_STREAM, socket, SHUT_RD
 from socket import inet_aton, IP_ADD_MEMBERSHIP,SOL_SOCKET, SO_REUSEADDR, SO_BROADCAST, SOCK_DGRAM, IPPROTO_IP
 from socket import error as soc_err
 import select
+import time
+from Queue import Queue
 
 from protocol import *
 from syncIO import *
+from sudoku import Board
+from leaderboard import Leaderboard
 
-from xmlrpclib import ServerProxy
+from xmlrpclib import ServerProxy, Transport, MultiCall, Fault
+from xmlrpclib import Error as RpcError
 
 import logging
 logfile = mktemp()
@@ -18,6 +23,82 @@ logging.basicConfig(filename=logfile,
                     format='%(asctime)s (%(threadName)-2s) %(message)s')
 
 
+class Future(object):
+    """
+    Result of a call running on another thread, filled in once it is done
+    (Python 2 has no concurrent.futures)
+    """
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__done = Event()
+        self.__result = None
+        self.__exception = None
+        self.__callbacks = []
+
+    def set_result(self, result):
+        self.__finish(result, None)
+
+    def set_exception(self, exception):
+        self.__finish(None, exception)
+
+    def __finish(self, result, exception):
+        with self.__lock:
+            self.__result, self.__exception = result, exception
+            self.__done.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def done(self):
+        return self.__done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the call to finish
+        :return: result of the call, its exception is raised here
+        :raises RuntimeError: the call did not finish within timeout seconds
+        """
+        if not self.__done.wait(timeout):
+            raise RuntimeError('Call did not finish in %s seconds' % timeout)
+        if self.__exception is not None:
+            raise self.__exception
+        return self.__result
+
+    def add_done_callback(self, fn):
+        """
+        Call fn(future) once the call is done, right away if it is done already.
+        Runs on the thread that finished the call
+        """
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(fn)
+                return
+        fn(self)
+
+
+class KeepAliveTransport(Transport):
+    """
+    XML-RPC transport keeping one HTTP/1.1 connection to the server open
+    (xmlrpclib reuses it as long as the server does not close it).
+    Threads of the client take turns on the connection. A call on the
+    connection the server has closed meanwhile is repeated once on a new
+    one, any other failure drops it and the next call opens a new one
+    """
+
+    def __init__(self, use_datetime=0):
+        Transport.__init__(self, use_datetime)
+        self.__lock = RLock()
+
+    def request(self, host, handler, request_body, verbose=0):
+        with self.__lock:
+            return Transport.request(self, host, handler, request_body, verbose)
+
+    def close(self):
+        with self.__lock:
+            Transport.close(self)
+
+
 class Client:
 
     __gm_states = enum(
@@ -36,6 +117,7 @@ class Client:
     def __init__(self, io):
         # Network related
         self.__send_lock = Lock()   # Only one entity can send out at a time
+        self.__state_lock = Lock()  # Guards the local copy of the state, never held over the network
 
         # Here we collect the received responses and notify the waiting entities
         self.__rcv_sync_msgs_lock = Condition()  # To wait/notify on received
@@ -49,10 +131,22 @@ class Client:
         self.__gm_state_lock = Lock()
         self.__gm_state = self.__gm_states.NOTCONNECTED
         self.__my_name = None
-        self.__current_progress = []
+        self.__current_progress = None  # Board, None when there is no game
+        self.__leaderboard = Leaderboard()
+        self.__version = -1  # Version of the game state we have, -1 - nothing yet
+        self.__synced = 0  # When the state was last checked with the server
+        self.__stale = True  # State is known to be behind the server
+        # Seconds to trust the state kept up to date by notifications
+        self.resync_interval = DEFAULT_RESYNC_INTERVAL
+        self.__guess_queue_lock = Lock()
+        self.__guess_queue = []  # Guesses waiting for flush_guesses, [num, row, col]
 
         # RPC proxy
         self.__proxy = None
+        # Separate proxy for long polling, waiting must not hold the send lock
+        self.__poll_proxy = None
+        # Get updates with wait_for_update instead of multicast notifications
+        self.use_longpoll = False
 
         # List of currently available servers
         self.available_servers = []
@@ -63,10 +157,18 @@ class Client:
         # IP and port of current game server
         self.ip = None
         self.port = None
+        # Room of the game server to play in
+        self.room = DEFAULT_ROOM
 
         # Current game status
         self.in_game = False
 
+        # Calls submitted by the UI run on this thread one by one, in order
+        self.__async_calls = Queue()
+        self.__async_thread = Thread(name='ClientCallsThread', target=self.__async_loop)
+        self.__async_thread.daemon = True
+        self.__async_thread.start()
+
         # Broadcast IP receiver socket
         self.receiver_sock = socket(AF_INET, SOCK_DGRAM)
         # membership = inet_aton(DEFAULT_SERVER_INET_ADDR) + inet_aton(bind_addr)
@@ -79,7 +181,6 @@ class Client:
         # Notification receiver socket
         self.notification_sock = socket(AF_INET, SOCK_DGRAM)
         self.notification_sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        self.notification_sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
         self.notification_sock.setblocking(0)
 
     def set_gui(self, gui):
@@ -104,7 +205,9 @@ class Client:
         logging.debug('Requesting the server to set player\'s name to %s ...' % name)
         #rsp = self.__sync_request(REQ_GM_SET_NAME, payload)
         with self.__send_lock:
-            rsp = self.__proxy.check_name(name)
+            rsp, modified = self.__changes_along(lambda batch: batch.check_name(self.room, name))
+        if modified:
+            self.__progress_changed()
         if rsp is not None:
             if rsp:
                 logging.debug('Server confirmed player\'s name')
@@ -125,7 +228,9 @@ class Client:
         logging.debug('Requesting the server to the new sudoku to guess with complexity %s ...' % complexity)
         #rsp = self.__sync_request(REQ_GM_SET_SUDOKU, payload)
         with self.__send_lock:
-            rsp = self.__proxy.set_new_sudoku(self.__my_name, complexity)
+            rsp, modified = self.__changes_along(lambda batch: batch.set_new_sudoku(self.room, self.__my_name, complexity))
+        if modified:
+            self.__progress_changed()
         if rsp is not None:
             if rsp:
                 logging.debug('Server confirmed complexity settings: %s' % complexity)
@@ -151,7 +256,10 @@ class Client:
         #payload = serialize((num,pos, self.__my_name))
         #rsp = self.__sync_request(REQ_GM_GUESS, payload)
         with self.__send_lock:
-            rsp = self.__proxy.guess_number(num,pos, self.__my_name)
+            # Guess and the changes it made come in one round trip
+            rsp, modified = self.__changes_along(lambda batch: batch.guess_number(self.room, num, pos, self.__my_name))
+        if modified:
+            self.__progress_changed()
         if rsp is not None:
             if rsp:
                 logging.debug('Server confirmed %i on [%i][%i]' % (num, pos[0], pos[1]))
@@ -159,43 +267,246 @@ class Client:
             else:
                 logging.debug('Server rejected %i on [%i][%i]' % (num, pos[0], pos[1]))
                 self.notify('Wrong number %i on [%i][%i]' % (num, pos[0], pos[1]))
-                self.get_current_progress()
                 return False
 
-    def get_current_progress(self):
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) on the client calls thread, the caller does not wait
+        :return: Future
+        """
+        future = Future()
+        self.__async_calls.put((future, fn, args))
+        return future
+
+    def __async_loop(self):
+        while True:
+            future, fn, args = self.__async_calls.get()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                logging.error('Call %s failed: %s' % (fn.__name__, e))
+                future.set_exception(e)
+
+    def guess_number_async(self, num, row, col):
+        """
+        Guess the number without waiting for the server
+        :return: Future, True if the number is right
+        """
+        return self.submit(self.guess_number, '%s %s %s' % (num, row, col))
+
+    def queue_guess(self, num, row, col):
+        """
+        Queue the guess to be sent with the next flush_guesses,
+        flushes right away when the batch is full
+        :return: list of booleans if the queue was flushed, None otherwise
+        """
+        with self.__guess_queue_lock:
+            self.__guess_queue.append([int(num), int(row), int(col)])
+            full = len(self.__guess_queue) >= MAX_GUESS_BATCH
+        if full:
+            return self.flush_guesses()
+        return None
+
+    def flush_guesses(self):
+        """
+        Send all queued guesses in one request
+        :return: list of booleans, result of every guess in order
+        """
+        with self.__guess_queue_lock:
+            guesses, self.__guess_queue = self.__guess_queue, []
+        results = []
+        # Server takes MAX_GUESS_BATCH guesses per request at most
+        for start in range(0, len(guesses), MAX_GUESS_BATCH):
+            results.extend(self.__send_guesses(guesses[start:start + MAX_GUESS_BATCH]))
+        return results
+
+    def __send_guesses(self, guesses):
+        """
+        Check guesses in one request, update the local copy with the results
+        :return: list of booleans, result of every guess in order
+        """
+        logging.debug('Requesting the server to check %d guesses ...' % len(guesses))
+        with self.__send_lock:
+            rsp = self.__proxy.guess_numbers(self.room, guesses, self.__my_name)
+        results = rsp['results']
+        with self.__state_lock:
+            if rsp['version'] == self.__version + len(guesses) and self.__current_progress is not None:
+                # Nobody else changed the state meanwhile, our guesses are all the changes
+                for (num, row, col), ok in zip(guesses, results):
+                    if ok:
+                        self.__current_progress[row, col] = num
+                    self.__leaderboard.set(self.__my_name, self.__leaderboard.get(self.__my_name, 0) + (1 if ok else -1))
+                self.__version = rsp['version']
+            else:
+                # Others' changes are mixed in, get them on the next read
+                self.__stale = True
+        for (num, row, col), ok in zip(guesses, results):
+            if not ok:
+                self.notify('Wrong number %i on [%i][%i]' % (num, row, col))
+        logging.debug('Server confirmed %d of %d guesses' % (sum(results), len(results)))
+        return results
+
+    def get_top(self, k=DEFAULT_LEADERBOARD_SIZE):
+        """
+        Ask the server for the first k players
+        :return: list of [name, points], best first
+        """
+        with self.__send_lock:
+            return self.__proxy.get_top(self.room, k)
+
+    def get_rank(self):
+        """
+        Ask the server for the place of the player
+        :return: tuple, (place from 1, points)
+        """
+        with self.__send_lock:
+            rank, points = self.__proxy.get_rank(self.room, self.__my_name)
+        return rank, points
+
+    def get_current_progress(self, refresh=False):
         """
-        Get current progress of sudoku guessing and players leaderboard (tuple)
+        Get current progress of sudoku guessing and players leaderboard (tuple).
+        Served from the local copy kept up to date by notifications, the server
+        is asked only when the copy fell behind or was not checked for
+        resync_interval seconds
+        :param refresh: boolean, ask the server anyway
         """
+        if refresh or self.__resync_due():
+            self.__resync()
+        return self.get_local_progress()
+
+    def __resync_due(self):
+        with self.__state_lock:
+            return self.__stale or time.time() - self.__synced >= self.resync_interval
 
-        logging.debug('Requesting the current state ...')
+    def __resync(self):
+        """
+        Bring the local copy up to date with the server
+        """
+        logging.debug('Requesting changes since version %d ...' % self.__version)
         #rsp = self.__sync_request(REQ_GM_GET_STATE)
-        uncovered_sudoku, leaderboard = None, None
         with self.__send_lock:
-            rsp = self.__proxy.get_current_state()
-        if rsp is not None:
+            rsp = self.__proxy.get_changes(self.room, self.__version)
+        self.__apply_changes(rsp)
+        if rsp['modified']:
             #head, payload = rsp
             #if head == RSP_GM_STATE:
             #    uncovered_sudoku, leaderboard = deserialize(payload)
-            uncovered_sudoku, leaderboard = rsp
-            self.__current_progress = uncovered_sudoku
-            if len(uncovered_sudoku) > 0:
-                logging.debug('Current uncovered sudoku [%s] received' %
-                              [' '.join([str(c) for c in lst]) for lst in uncovered_sudoku])
-                self.notify('Current progress: [%s]' %
-                                      [' '.join([str(c) for c in lst]) for lst in uncovered_sudoku])
-                self.notify('Current leaderboard: [%s]' % str(leaderboard))
-                self.__state_change(self.__gm_states.NEED_NUMBER)
+            self.__progress_changed()
+
+    def __changes_along(self, call):
+        """
+        Send the call together with get_changes in one round trip, apply
+        the changes, send lock should be held
+        :param call: callable(MultiCall), adds the call to the batch
+        :return: tuple, (result of the call, boolean - state has changed)
+        """
+        batch = MultiCall(self.__proxy)
+        call(batch)
+        batch.get_changes(self.room, self.__version)
+        rsp, changes = batch()
+        self.__apply_changes(changes)
+        return rsp, changes['modified']
+
+    def get_local_progress(self):
+        """
+        Progress and leaderboard as the client knows them, no request is sent
+        """
+        with self.__state_lock:
+            return self.__local_progress()
+
+    def __local_progress(self):
+        # Board is indexed flat, 81 cells, leaderboard is ranked list of [name, points]
+        return self.__current_progress, self.__leaderboard.top(DEFAULT_LEADERBOARD_SIZE)
+
+    def __progress_changed(self):
+        """
+        Show new progress to the player, switch game state
+        """
+        if self.__current_progress is not None:
+            rows = [' '.join([str(c) for c in lst]) for lst in self.__current_progress.rows()]
+            logging.debug('Current uncovered sudoku [%s] received' % rows)
+            self.notify('Current progress: [%s]' % rows)
+            self.notify('Current leaderboard: [%s]' % str(self.__leaderboard.top(DEFAULT_LEADERBOARD_SIZE)))
+            self.__state_change(self.__gm_states.NEED_NUMBER)
+        else:
+            if self.__gm_state != self.__gm_states.NEED_SUDOKU:
+                self.__state_change(self.__gm_states.NEED_SUDOKU)
+
+    def __apply_changes(self, changes):
+        """
+        Apply state changes received from get_changes to the local copy
+        """
+        with self.__state_lock:
+            # Copy is checked with the server either way
+            self.__synced = time.time()
+            self.__stale = False
+            # Notifications could bring us further while the response was on its way
+            if not changes['modified'] or changes['version'] < self.__version:
+                return
+            if changes['full']:
+                board = changes['board'].data
+                self.__current_progress = Board(board) if board else None
+                self.__leaderboard = Leaderboard(changes['scores'])
             else:
-                if self.__gm_state != self.__gm_states.NEED_SUDOKU:
-                    self.__state_change(self.__gm_states.NEED_SUDOKU)
-        # Return 1D list
-        return [item for sublist in self.__current_progress for item in sublist], leaderboard
+                for i, v in changes['cells']:
+                    self.__current_progress[i] = v
+                for name, points in changes['scores'].items():
+                    self.__leaderboard.set(name, points)
+            self.__version = changes['version']
+        logging.debug('State updated to version %d' % changes['version'])
+
+    def __apply_event(self, event):
+        """
+        Apply game event from notification to the local copy of the state
+        :return: boolean, False if some events were missed and the state should be fetched
+        """
+        with self.__state_lock:
+            version = event['version']
+            if version <= self.__version:
+                # Already have it (e.g. fetched together with the state)
+                return True
+            if version != self.__version + 1:
+                logging.debug('Missed events %d..%d' % (self.__version + 1, version - 1))
+                return False
+            kind = event['type']
+            if kind in (EVT_NEW, EVT_SOLVED):
+                board = event.get('board')
+                self.__current_progress = Board(int(c) for c in board) if board else None
+            elif kind == EVT_GUESS:
+                if self.__current_progress is None:
+                    return False
+                self.__current_progress[event['cell']] = event['value']
+            if 'points' in event:
+                self.__leaderboard.set(event['name'], event['points'])
+            self.__version = version
+        return True
+
+    @staticmethod
+    def describe_event(event):
+        """
+        Human readable text of game event
+        """
+        kind, name = event['type'], event['name']
+        if kind == EVT_JOIN:
+            return '%s joined the game!' % name
+        if kind == EVT_NEW:
+            return '%s did set new sudoku to guess!' % name
+        if kind == EVT_GUESS:
+            return '%s did guess %i in position [%i][%i]!' % ((name, event['value']) + divmod(event['cell'], 9))
+        if kind == EVT_MISS:
+            return '%s missed (%+d)' % (name, event['delta'])
+        if kind == EVT_SOLVED:
+            return '%s did solve the sudoku' % name
+        return '%s: %s' % (name, kind)
 
     def stop(self):
         """
         Stop the game client
         """
 
+        if self.__proxy is not None:
+            self.__proxy('close')()
         try:
             self.__s.shutdown(SHUT_RD)
         except soc_err:
@@ -211,6 +522,7 @@ class Client:
         """
 
         self.__s = socket(AF_INET, SOCK_STREAM)
+        self.__reader = FrameReader(self.__s)
         try:
             self.__s.connect(srv_addr)
             logging.info('Connected to Game server at %s:%d' % srv_addr)
@@ -226,8 +538,13 @@ class Client:
         Connect to proxy server, start game session
         """
         try:
-            self.__proxy = ServerProxy("http://%s:%d" % srv_addr)
+            # Every call goes over the same connection instead of a new one
+            self.__proxy = ServerProxy("http://%s:%d" % srv_addr, transport=KeepAliveTransport())
             self.__proxy.__allow_none = True
+            # Long polling waits on a connection of its own
+            self.__poll_proxy = ServerProxy("http://%s:%d" % srv_addr, transport=KeepAliveTransport())
+            self.__version = -1
+            self.__stale = True
             logging.info('Connected to Game server at %s:%d' % srv_addr)
             self.__state_change(self.__gm_states.NEED_NAME)
             methods = filter(lambda x: 'system.' not in x, self.__proxy.system.listMethods())
@@ -246,6 +563,7 @@ class Client:
     def __sync_request(self, header, payload=''):
         """
         Send request and wait for response
+        :return: tuple, (response code, payload), None if the session is gone
         """
 
         with self.__send_lock:
@@ -256,7 +574,8 @@ class Client:
                         self.__rcv_sync_msgs_lock.wait()
                     rsp = self.__rcv_sync_msgs.pop()
                 if rsp != 'DIE!':
-                    return rsp.split(MSG_FIELD_SEP)
+                    # Binary payloads can hold the separator, only the header is split off
+                    return rsp[0], rsp[2:]
             return None
 
     def __sync_response(self, rsp):
@@ -283,21 +602,20 @@ class Client:
 
     def __session_rcv(self):
         """
-        Receive the block of data till next block separator
+        Receive the next frame of data
         """
 
-        m, b = '', ''
+        m = ''
         try:
-            b = self.__s.recv(DEFAULT_RCV_BUFSIZE)
-            m += b
-            while len(b) > 0 and not (b.endswith(MSG_SEP)):
-                b = self.__s.recv(DEFAULT_RCV_BUFSIZE)
-                m += b
-            if len(b) <= 0:
+            m = self.__reader.read()
+            if m is None:
                 logging.debug('Socket receive interrupted')
                 self.__s.close()
                 m = ''
-            m = m[:-1]
+        except ValueError as e:
+            logging.error('Malformed frame from server: %s' % e)
+            self.__s.close()
+            m = ''
         except KeyboardInterrupt:
             self.__s.close()
             logging.info('Ctrl+C issued, terminating ...')
@@ -314,14 +632,12 @@ class Client:
 
     def __session_send(self,msg):
         """
-        Just wrap the data, append the block separator and send out
+        Just wrap the data into a length-prefixed frame and send out
         """
 
-        m = msg + MSG_SEP
-
         r = False
         try:
-            self.__s.sendall(m)
+            send_frames(self.__s, msg)
             r = True
         except KeyboardInterrupt:
             self.__s.close()
@@ -348,13 +664,14 @@ class Client:
         logging.debug('Response control code [%s]' % message[0])
         if message.startswith(RSP_GM_NOTIFY + MSG_FIELD_SEP):
             payload = message[2:]
-            notification = deserialize(payload)
+            notification = deserialize(RSP_GM_NOTIFY, payload)
             logging.debug('Server notification received: %s' % notification)
             self.__async_notification(notification)
         elif message[:2] in map(lambda x: x+MSG_FIELD_SEP,  [RSP_GM_GUESS,
                                                              RSP_GM_SET_SUDOKU,
                                                              RSP_GM_SET_NAME,
-                                                             RSP_GM_STATE]):
+                                                             RSP_GM_STATE,
+                                                             RSP_GM_NOT_JOINED]):
             self.__sync_response(message)
         else:
             logging.debug('Unknown control message received: %s ' % message)
@@ -410,7 +727,7 @@ class Client:
                 if msg == 'DIE!':
                     return
             self.notify('Server Notification: %s' % msg)
-            state, lb = self.get_current_progress()
+            state, lb = self.get_current_progress(refresh=True)
 
             # If GUI mode, update sudoku board
             if state and self.gui is not None:
@@ -437,8 +754,73 @@ class Client:
             self.gui.notify(text)
 
     def setup_notification_socket(self):
-        logging.info("Notification socket was bind to port %s" % (int(self.port) + 1, ))
+        group = room_group(self.room)
+        logging.info("Notification socket was bind to %s:%s" % (group, int(self.port) + 1))
         self.notification_sock.bind(("", int(self.port) + 1))
+        # Receive notifications of our room only
+        membership = inet_aton(group) + inet_aton('0.0.0.0')
+        self.notification_sock.setsockopt(IPPROTO_IP, IP_ADD_MEMBERSHIP, membership)
+
+    def __recover_events(self):
+        """
+        Fetch notifications missed since our version and apply them
+        :return: boolean, False if server does not keep them anymore
+        """
+        logging.debug('Requesting events missed since version %d ...' % self.__version)
+        with self.__send_lock:
+            rsp = self.__proxy.get_events(self.room, self.__version)
+        if not rsp['available']:
+            return False
+        for line in rsp['events']:
+            event = unpack_event(line)
+            self.notify('Server Notification: %s' % self.describe_event(event))
+            if not self.__apply_event(event):
+                return False
+        return True
+
+    def __room_exists(self):
+        """
+        :return: boolean, False only if the server says our room is gone
+        """
+        try:
+            with self.__send_lock:
+                return self.room in self.__proxy.list_rooms()
+        except (IOError, RpcError):
+            return True
+
+    def longpoll_loop(self):
+        """
+        Receive updates by long polling the server, for networks where
+        multicast notifications do not get through
+        """
+        logging.info('Falling to long polling loop ...')
+        while True:
+            try:
+                rsp = self.__poll_proxy.wait_for_update(self.room, self.__version, DEFAULT_LONGPOLL_TIMEOUT)
+            except Fault as e:
+                logging.error('Long polling error: %s' % e)
+                if not self.__room_exists():
+                    logging.info('Room %s was closed, long polling stopped' % self.room)
+                    self.notify('Room %s was closed' % self.room)
+                    return
+                time.sleep(1)
+                continue
+            except (IOError, RpcError) as e:
+                logging.error('Long polling error: %s' % e)
+                time.sleep(1)
+                continue
+            # Our own requests could bring us further meanwhile, older response is skipped
+            self.__apply_changes(rsp)
+            if not rsp['modified']:
+                continue
+            self.notify('Server Notification: state updated to version %d' % rsp['version'])
+            self.__progress_changed()
+            state, lb = self.get_local_progress()
+
+            # If GUI mode, update sudoku board
+            if state and self.gui is not None:
+                self.gui.set_sudoku(state)
+                self.gui.set_leaderboard(lb)
 
     def receiver_loop(self):
         logging.info('Falling to receiver loop ...')
@@ -449,15 +831,45 @@ class Client:
                     ready = select.select([self.notification_sock], [], [], 2)
                     if ready[0]:
                         data, addr = self.notification_sock.recvfrom(DEFAULT_RCV_BUFFSIZE)
+                    elif self.__version >= 0 and self.__resync_due():
+                        # Quiet for long, check the last notifications were not lost
+                        state, lb = self.get_current_progress()
+                        if state and self.gui is not None:
+                            self.gui.set_sudoku(state)
+                            self.gui.set_leaderboard(lb)
+                        continue
                     else:
                         continue
                     #message = data.split()
                     #logging.info('Received message type: %s', type(data))
                     #logging.info('Received message: %s', data)
                     #print('Received message: ', data)
+                    room, _, data = data.partition(MSG_FIELD_SEP)
+                    if room != self.room:
+                        # Notification from another room of the same server
+                        continue
                     logging.debug("Received broadcast notification")
-                    self.notify('Server Notification: %s' % data)
-                    state, lb = self.get_current_progress()
+                    # Events that happened close in time come in one datagram,
+                    # apply them locally, fetch the state only if some were missed
+                    in_sync = True
+                    for line in data.split(MSG_EVENT_SEP):
+                        event = unpack_event(line)
+                        if event is None:
+                            logging.debug('Unknown notification: %s' % line)
+                            in_sync = False
+                            continue
+                        if not in_sync or event['version'] <= self.__version:
+                            continue
+                        if self.__apply_event(event):
+                            self.notify('Server Notification: %s' % self.describe_event(event))
+                        else:
+                            # Datagrams were lost, get the missed events (this one included)
+                            in_sync = self.__recover_events()
+                    if in_sync:
+                        self.__progress_changed()
+                        state, lb = self.get_local_progress()
+                    else:
+                        state, lb = self.get_current_progress(refresh=True)
 
                     # If GUI mode, update sudoku board
                     if state and self.gui is not None:
@@ -6,30 +6,130 @@ import logging
 import threading
 # from functools import partial
 import re
+from Queue import Queue, Empty
 import netifaces as ni
 # import sudoku as su
 
 from protocol import *
+from sudoku import Board
 
 FORMAT = '%(asctime)-15s (%(threadName)-2s) %(levelname)s %(message)s'
 logging.basicConfig(level=logging.DEBUG, format=FORMAT)
 LOG = logging.getLogger()
 
 
+class UiQueue:
+    """
+    Calls posted from any thread run on the Tk thread:
+    Tk event loop drains the queue with after()
+    """
+    def __init__(self, widget, interval=DEFAULT_UI_POLL_INTERVAL):
+        self.widget = widget
+        self.interval = interval
+        self.calls = Queue()
+        self.widget.after(self.interval, self.drain)
+
+    def post(self, fn, *args):
+        """
+        Call fn(*args) on the Tk thread
+        """
+        self.calls.put((fn, args))
+
+    def drain(self):
+        try:
+            while True:
+                fn, args = self.calls.get_nowait()
+                try:
+                    fn(*args)
+                except Exception:
+                    LOG.exception("UI call %s failed" % fn.__name__)
+        except Empty:
+            pass
+        self.widget.after(self.interval, self.drain)
+
+
+class UpdatePump:
+    """
+    Board and leaderboard updates posted from any thread. The Tk thread
+    takes them from the queue at most `fps` times a second and applies
+    the newest of each only, a burst of notifications is one redraw
+    """
+    BOARD, LEADERBOARD = 0, 1
+
+    def __init__(self, widget, set_board, set_leaderboard, fps=DEFAULT_UI_MAX_FPS):
+        """
+        :param widget: Tk widget to schedule on
+        :param set_board: callable(board), draws the board
+        :param set_leaderboard: callable(table), fills the leaderboard
+        """
+        self.widget = widget
+        self.interval = max(1, int(1000.0 / fps))
+        self.updates = Queue()
+        self.apply = {self.BOARD: set_board, self.LEADERBOARD: set_leaderboard}
+        # Statistics
+        self.posted = 0
+        self.applied = 0
+        self.widget.after(self.interval, self.tick)
+
+    def post_board(self, board):
+        self.updates.put((self.BOARD, board))
+
+    def post_leaderboard(self, table):
+        self.updates.put((self.LEADERBOARD, table))
+
+    def take(self):
+        """
+        Empty the queue
+        :return: dict, kind: newest value posted
+        """
+        newest = {}
+        try:
+            while True:
+                kind, value = self.updates.get_nowait()
+                newest[kind] = value
+                self.posted += 1
+        except Empty:
+            pass
+        return newest
+
+    def tick(self):
+        for kind, value in self.take().items():
+            try:
+                self.apply[kind](value)
+                self.applied += 1
+            except Exception:
+                LOG.exception("UI update failed")
+        self.widget.after(self.interval, self.tick)
+
+
 class SudokuFrame(tk.Frame):
     """
     Class for sudoku board
     """
-    def __init__(self, parent):
+    # Color of a digit waiting for the server to check it
+    pending_fg = "gray60"
+
+    def __init__(self, parent, ui_queue=None):
         tk.Frame.__init__(self, parent)
 
         self.client = None
         self.lb = None
-        self.lock = threading.Lock()
+        # Reentrant: rejected digit is cleared under the lock, that triggers report_changes
+        self.lock = threading.RLock()
+        # Results of guesses come back through the queue
+        self.ui_queue = ui_queue or UiQueue(self)
+        # Cells waiting for the server to check them, index: digit
+        self.pending = {}
+
+        # Board shown by the boxes, None before the first one
+        self.rendered = None
+        # Newest board waiting for the idle callback to draw it
+        self.next_board = None
+        # Boxes are being changed by us, not by the player
+        self.rendering = False
 
         # Create trackers for sudoku boxes
         self.box_values = [tk.StringVar() for i in range(81)]
-        self.box_tracers = []
         # Generate a list of boxes
         self.boxes = [tk.Entry(self,
                                width=3,
@@ -49,6 +149,10 @@ class SudokuFrame(tk.Frame):
             pady = (20, 4) if r == 3 or r == 6 else 4
 
             b.grid(row=r, column=c, ipadx=0, padx=padx, ipady=4, pady=pady)
+        self.fg = self.boxes[0].cget("fg")
+
+        # Track changes in sudoku
+        self.box_tracers = [sv.trace("w", lambda name, index, mode, sv=sv: self.report_changes(sv)) for sv in self.box_values]
 
     def set_client(self, client):
         """
@@ -83,33 +187,64 @@ class SudokuFrame(tk.Frame):
 
     def report_changes(self, sv):
         """
-        Trigger for sudoku changing
+        Trigger for sudoku changing: send the guess, do not wait for the answer
         :param sv: StringVar, changed variable
         :return: current state of sudoku
         """
         with self.lock:
+            if self.rendering:
+                return
             v = sv.get()
             i = self.box_values.index(sv)
             r = i // 9
             c = i % 9
             LOG.debug("Value %s has changed: %s" % (sv, v))
 
+            if not v:
+                # Cleared cell, nothing to guess
+                return self.get_current_state()
+
             if self.client is None:
                 logging.error("Client is not connected to SudokuFrame")
                 return self.get_current_state()
 
-            if self.client.guess_number("%s %s %s" % (v, r, c)):
+            # Digit stays as pending until the server checks it
+            self.pending[i] = v
+            self.boxes[i].config(state="readonly", fg=self.pending_fg)
+            future = self.client.guess_number_async(v, r, c)
+            future.add_done_callback(lambda f: self.ui_queue.post(self.guess_done, i, v, f))
+            return self.get_current_state()
+
+    def guess_done(self, i, v, future):
+        """
+        Confirm or revert the pending digit, runs on the Tk thread
+        :param i: int, index of the cell
+        :param v: str, guessed digit
+        :param future: Future of the guess
+        """
+        with self.lock:
+            if self.pending.get(i) != v:
+                # Board was set anew meanwhile
+                return
+            del self.pending[i]
+            try:
+                ok = future.result()
+            except Exception:
+                ok = False
+            self.boxes[i].config(fg=self.fg)
+            if ok:
                 logging.debug("Number confirmed")
-                self.boxes[i].config(state="readonly")
+                if self.rendered is not None:
+                    # Shown already, the next board needs to change it only if it differs
+                    self.rendered[i] = int(v)
             else:
                 logging.debug("Number rejected")
-                # TODO: do we need to clear this field immediately?
-                sv.set("")
-
-            state, lb = self.client.get_current_progress()
+                self.boxes[i].config(state=tk.NORMAL)
+                self.box_values[i].set("")
 
+            # Guess brought the changes along, nothing to ask the server
+            state, lb = self.client.get_local_progress()
             self.lb.fill(lb)
-            return self.get_current_state()
 
     def get_current_state(self):
         """
@@ -144,30 +279,53 @@ class SudokuFrame(tk.Frame):
 
     def set_sudoku(self, sudoku):
         """
-        Render list sudoku on the board
-        :param sudoku: list, length 81
+        Render list sudoku on the board. Boards set in a row are drawn
+        once, the newest one, when Tk is idle
+        :param sudoku: Board (or any flat sequence of 81 ints)
         :return: None
         """
         LOG.debug("Got unsolved sudoku with %d elements" % len(sudoku))
 
         with self.lock:
-            # Remove tracers for updating
-            if self.box_tracers:
-                for i, sv in enumerate(self.box_values):
-                    # print self.box_tracers[i]
-                    sv.trace_vdelete("w", self.box_tracers[i])
-
-            for i, b in enumerate(self.boxes):
-                # Fix values that are not zero
-                b.config(state=tk.NORMAL)
-                # b.delete(0, 'end')
-                if sudoku[i]:
-                    self.box_values[i].set(sudoku[i])
-                    # b.insert(0, sudoku[i])
-                    b.config(state=tk.DISABLED)
-
-            # Track changes in sudoku
-            self.box_tracers = [sv.trace("w", lambda name, index, mode, sv=sv: self.report_changes(sv)) for sv in self.box_values]
+            # Copy: the client goes on changing its board
+            first = self.next_board is None
+            self.next_board = Board(sudoku)
+            if first:
+                self.after_idle(self.redraw)
+
+    def redraw(self):
+        """
+        Change the boxes that differ from the board drawn last time
+        """
+        with self.lock:
+            board, self.next_board = self.next_board, None
+            if board is None:
+                return
+            if self.rendered is None:
+                changed = list(enumerate(board))
+                self.rendered = Board()
+            else:
+                changed = self.rendered.diff(board)
+            LOG.debug("Redraw %d cells" % len(changed))
+
+            self.rendering = True
+            try:
+                for i, v in changed:
+                    if i in self.pending and not v:
+                        # Server has not checked it yet
+                        continue
+                    self.pending.pop(i, None)
+                    b = self.boxes[i]
+                    if v:
+                        # Fix values that are not zero
+                        self.box_values[i].set(v)
+                        b.config(state=tk.DISABLED, fg=self.fg)
+                    else:
+                        b.config(state=tk.NORMAL, fg=self.fg)
+                        self.box_values[i].set("")
+                    self.rendered[i] = v
+            finally:
+                self.rendering = False
             # tkMessageBox.showinfo("Info", "New sudoku was generated")
 
 
@@ -176,7 +334,7 @@ class LeaderboardFrame(tk.Frame):
     Class for leaderboard
     tkinter Treeview
     """
-    def __init__(self, parent, players_limit=8, width=25):
+    def __init__(self, parent, players_limit=DEFAULT_LEADERBOARD_SIZE, width=25):
         tk.Frame.__init__(self, parent, width=width)
         self.title = tk.Label(self,
                               text="Leaderboard",
@@ -205,12 +363,12 @@ class LeaderboardFrame(tk.Frame):
     def fill(self, table):
         """
         Fill leaderboard with data from server
-        :param table: dict, player: points
+        :param table: list of [player, points], already ranked, best first
         :return: None
         """
         self.tree.delete(*self.tree.get_children())
-        for i, player in enumerate(sorted(table, key=table.get)):
-            self.tree.insert("", "end", text=str(i+1), values=(player, table[player]))
+        for i, (player, points) in enumerate(table[:self.players_limit]):
+            self.tree.insert("", "end", text=str(i+1), values=(player, points))
 
 
 class SessionsFrame(tk.Frame):
@@ -443,7 +601,7 @@ class MenuFrame(tk.Frame):
         Connect to the existing session
         :return: None
         """
-        self.frm_leaderboard.fill({"Misha": 10, "Vlad": 10})
+        self.frm_leaderboard.fill([["Misha", 10], ["Vlad", 10]])
         self.frm_sessions.fill(["Session1", "Session2"])
 
     def host(self):
@@ -525,10 +683,14 @@ class MenuFrame(tk.Frame):
         if self.client.connect_proxy(server_address):
             logging.debug("Client connected to %s:%s" % server_address)
 
-            # Setup notification socket to receive broadcast notifications
-            self.client.setup_notification_socket()
+            if self.client.use_longpoll:
+                receiver = self.client.longpoll_loop
+            else:
+                # Setup notification socket to receive multicast notifications
+                self.client.setup_notification_socket()
+                receiver = self.client.receiver_loop
             # Set and start client threads
-            self.thread_receiver = threading.Thread(name='ReceiverThread', target=self.client.receiver_loop)
+            self.thread_receiver = threading.Thread(name='ReceiverThread', target=receiver)
             self.thread_receiver.daemon = True
             self.thread_receiver.start()
             #self.thread_client_network = threading.Thread(name='client_network',target=self.client.network_loop)
@@ -706,6 +868,8 @@ class MainWindow(tk.Tk):
     """
     def __init__(self):
         tk.Tk.__init__(self)
+        # Other threads change widgets only through this queue
+        self.ui_queue = UiQueue(self)
 
         # Set window properties
         self.title("multisudoku")
@@ -718,7 +882,7 @@ class MainWindow(tk.Tk):
         # Sudoku pane
         self.pn_sudoku = tk.PanedWindow(self.pn_main, relief=tk.RAISED)
         self.pn_sudoku.pack(fill=tk.NONE)
-        self.frm_sudoku = SudokuFrame(self.pn_sudoku)
+        self.frm_sudoku = SudokuFrame(self.pn_sudoku, self.ui_queue)
         self.frm_sudoku.pack(side=tk.TOP)
 
         # Create menu frame and bound it with sudoku
@@ -728,6 +892,9 @@ class MainWindow(tk.Tk):
         self.pn_main.add(self.frm_menu)
         self.pn_main.add(self.pn_sudoku)
 
+        # Board and leaderboard updates from other threads, newest only
+        self.pump = UpdatePump(self, self.frm_sudoku.set_sudoku, self.frm_menu.frm_leaderboard.fill)
+
     def set_server(self, server):
         """
         Set server to control (run by Host button)
@@ -748,26 +915,27 @@ class MainWindow(tk.Tk):
     def notify(self, notification):
         """
         Add a new notification to the notification textbox
+        (safe to call from any thread)
         :param notification:
         :return: None
         """
-        return self.frm_menu.frm_notifications.add(notification)
+        self.ui_queue.post(self.frm_menu.frm_notifications.add, notification)
 
     def set_sudoku(self, sudoku):
         """
-        Set sudoku to the board
-        :param sudoku: list, 81 elements
+        Set sudoku to the board (safe to call from any thread)
+        :param sudoku: Board, 81 cells
         :return: None
         """
-        self.frm_sudoku.set_sudoku(sudoku)
+        self.pump.post_board(sudoku)
 
     def set_leaderboard(self, lb):
         """
-        Set leaderboard
-        :param lb: leaderboard, dict name: points
+        Set leaderboard (safe to call from any thread)
+        :param lb: leaderboard, list of [name, points], best first
         :return: None
         """
-        self.frm_menu.frm_leaderboard.fill(lb)
+        self.pump.post_leaderboard(lb)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,47 @@
+"""
+Helpers shared by the benchmarks, the bots and the tests: in-process
+server, headless client IO, percentiles
+"""
+import threading
+
+import server as s
+
+
+def start_server(port, workers, keepalive=True):
+    """
+    Start GameServer serving RPC in a background thread
+    :param port: int, port to listen
+    :param workers: int, number of RPC workers (0 - single-threaded)
+    :param keepalive: boolean, keep connections open between requests
+    :return: GameServer
+    """
+    server = s.GameServer(s.Game(), workers=workers, keepalive=keepalive)
+    server.port = port
+    server.listen()
+    server.set_broadcast_port(port + 1)
+    server.server.logRequests = False
+    t = threading.Thread(name='BenchServer', target=server.server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def stop_server(server):
+    server.server.shutdown()
+    server.server.server_close()
+
+
+class NullIO:
+    """
+    Headless clients have nobody to show the messages to
+    """
+    def output_sync(self, text):
+        pass
+
+
+def percentile(values, p):
+    """
+    :param values: sorted list
+    :param p: float, 0..100
+    """
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
@@ -0,0 +1,144 @@
+import random
+
+
+class _End(object):
+    """
+    Key of the tail sentinel, greater than any other key
+    """
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return isinstance(other, _End)
+
+    def __gt__(self, other):
+        return not isinstance(other, _End)
+
+    def __ge__(self, other):
+        return True
+
+
+class _Node(object):
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level  # Steps on the bottom level that next[level] jumps over
+
+
+class Leaderboard(object):
+    """
+    Players ranked by points, highest first (ties by name).
+    Kept in an indexable skip list: changing a score, rank of a player
+    and the top-k take O(log n) (plus k), no sorting of the whole table
+    """
+    MAX_LEVEL = 16
+
+    def __init__(self, scores=None):
+        self.__tail = _Node(_End(), 0)
+        self.__head = _Node(None, self.MAX_LEVEL)
+        self.__head.next = [self.__tail] * self.MAX_LEVEL
+        self.__scores = {}  # name: points
+        if scores:
+            for name, points in scores.items():
+                self.set(name, points)
+
+    @staticmethod
+    def __key(name, points):
+        return -points, name
+
+    def __len__(self):
+        return len(self.__scores)
+
+    def __contains__(self, name):
+        return name in self.__scores
+
+    def get(self, name, default=None):
+        return self.__scores.get(name, default)
+
+    def scores(self):
+        """
+        :return: dict, name: points (copy)
+        """
+        return dict(self.__scores)
+
+    def __chain(self, key):
+        """
+        Last node before key on every level and its position (1-based, head is 0)
+        """
+        chain = [None] * self.MAX_LEVEL
+        positions = [0] * self.MAX_LEVEL
+        node, position = self.__head, 0
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def __insert(self, key):
+        chain, positions = self.__chain(key)
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        node = _Node(key, level)
+        for i in range(level):
+            prev = chain[i]
+            # Bottom level steps from prev to the new node
+            steps = positions[0] - positions[i] + 1
+            node.next[i] = prev.next[i]
+            node.width[i] = prev.width[i] - steps + 1
+            prev.next[i] = node
+            prev.width[i] = steps
+        for i in range(level, self.MAX_LEVEL):
+            chain[i].width[i] += 1
+
+    def __remove(self, key):
+        chain, _ = self.__chain(key)
+        node = chain[0].next[0]
+        for i in range(len(node.next)):
+            prev = chain[i]
+            prev.width[i] += node.width[i] - 1
+            prev.next[i] = node.next[i]
+        for i in range(len(node.next), self.MAX_LEVEL):
+            chain[i].width[i] -= 1
+
+    def set(self, name, points):
+        """
+        Set points of the player, adds unknown player
+        """
+        old = self.__scores.get(name)
+        if old is not None:
+            if old == points:
+                return
+            self.__remove(self.__key(name, old))
+        self.__scores[name] = points
+        self.__insert(self.__key(name, points))
+
+    def remove(self, name):
+        points = self.__scores.pop(name, None)
+        if points is not None:
+            self.__remove(self.__key(name, points))
+
+    def rank(self, name):
+        """
+        :return: int, place of the player starting from 1, 0 if there is no such player
+        """
+        points = self.__scores.get(name)
+        if points is None:
+            return 0
+        _, positions = self.__chain(self.__key(name, points))
+        return positions[0] + 1
+
+    def top(self, k):
+        """
+        :return: list of [name, points] of the first k players, best first
+        """
+        result = []
+        node = self.__head.next[0]
+        while len(result) < k and node is not self.__tail:
+            result.append([node.key[1], -node.key[0]])
+            node = node.next[0]
+        return result
@@ -1,3 +1,4 @@
+import argparse
 import logging
 from Tkinter import Image
 
@@ -11,6 +12,11 @@ logging.basicConfig(level=logging.DEBUG, format=FORMAT)
 LOG = logging.getLogger()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Multiplayer concurrent sudoku')
+    parser.add_argument('--longpoll', action='store_true',
+                        help='get game updates by long polling the server (when multicast does not work)')
+    args = parser.parse_args()
+
     # Create ui
     ui = gui.MainWindow()
     # Set icon
@@ -29,6 +35,7 @@ if __name__ == "__main__":
     # TODO: remove syncIO dependency for GUI
     sync_io = SyncConsoleAppenderRawInputReader()
     client = c.Client(sync_io)
+    client.use_longpoll = args.longpoll
 
     # Set UI for client
     client.set_gui(ui)
@@ -1,4 +1,8 @@
-import pickle
+import json
+import string
+import struct
+import zlib
+from binascii import hexlify, unhexlify
 from base64 import decodestring, encodestring
 # Requests --------------------------------------------------------------------
 REQ_GM_GET_STATE = 'A'
@@ -24,26 +28,359 @@ MSG_FIELD_SEP = ':'
 # Message separator for sending multiple messages------------------------------
 MSG_SEP = ';'
 
-DEFAULT_RCV_BUFSIZE = 1
+# Session messages over TCP go in frames: 4 bytes of payload length, then payload
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 1 << 20  # Larger frame means broken or hostile peer
+
+DEFAULT_RCV_BUFSIZE = 64 * 1024  # Receive buffer of the session socket
 DEFAULT_RCV_BUFFSIZE = 1024
 
+# Separator of events merged into one notification datagram
+MSG_EVENT_SEP = '\n'
+DEFAULT_NOTIFY_WINDOW = 0.02  # Seconds to collect events for one datagram
+
+# Game events sent in notifications ------------------------------------------
+EVT_JOIN = 'join'  # Player joined the room
+EVT_NEW = 'new'  # New sudoku was set, carries the board
+EVT_GUESS = 'guess'  # Right number, carries the cell and the value
+EVT_MISS = 'miss'  # Wrong number
+EVT_SOLVED = 'solved'  # Board was uncovered completely and removed
+
 # Broadcast parameters
 DEFAULT_BROADCAST_IP_PORT = 5007  # Port for primary ip broadcasting (auto-discovery)
 # bind_addr = '0.0.0.0'
 
 DEFAULT_BROADCAST_ADDR = "<broadcast>"  # Default broadcast address
+
+# Multicast parameters for game notifications, every room has its own group
+DEFAULT_MULTICAST_PREFIX = '239.255'  # Administratively scoped (local) groups
+DEFAULT_MULTICAST_TTL = 1  # Do not leave the local network
 DEFAULT_HOSTING_ADDR = ""  # Server listens from all sources
 DEFAULT_HOSTING_PORT = 7777
 
+# RPC serving parameters
+DEFAULT_RPC_WORKERS = 8  # Threads serving RPC requests concurrently
+DEFAULT_RPC_BACKLOG = 64  # Accepted connections waiting for a free worker
+DEFAULT_KEEPALIVE_TIMEOUT = 60  # Seconds an idle keep-alive connection stays open
+DEFAULT_KEEPALIVE_MAX = 1024  # Idle keep-alive connections kept at the same time
+DEFAULT_RPC_TIMEOUT = 10  # Seconds a connection may stall while sending or receiving, then it is dropped
+
+# Long polling parameters
+DEFAULT_LONGPOLL_TIMEOUT = 30  # Seconds wait_for_update may block at most
+DEFAULT_LONGPOLL_MAX = 512  # Requests allowed to wait at the same time
+
+# Game state changes kept for delta updates, older clients get full state
+DEFAULT_CHANGELOG_SIZE = 512
+# Seconds the client trusts its copy of the state without asking the server
+DEFAULT_RESYNC_INTERVAL = 10
+
+# Puzzle pool parameters
+DEFAULT_POOL_SIZE = 4  # Ready puzzles kept for every complexity
+DEFAULT_POOL_COMPLEXITIES = (5,)  # Complexities pooled from the start
+
+# Most guesses checked in one guess_numbers call, larger batches are rejected
+MAX_GUESS_BATCH = 81
+
+# Players shown on the leaderboard
+DEFAULT_LEADERBOARD_SIZE = 8
+
+# Milliseconds between runs of the GUI over calls posted from other threads
+DEFAULT_UI_POLL_INTERVAL = 20
+# Most board and leaderboard redraws per second, the rest is skipped
+DEFAULT_UI_MAX_FPS = 30
+
+# Room every server creates on start, clients join it unless told otherwise
+DEFAULT_ROOM = 'main'
+DEFAULT_MAX_ROOMS = 512  # Rooms one server hosts at most, the default one included
+MAX_ROOM_ID_LENGTH = 32  # Room id goes in front of every notification datagram
+
+# Seconds between server statistics lines in the log, 0 - no lines
+DEFAULT_STATS_INTERVAL = 60
+# Buckets every power of two of latency is split into, values are off by 1/32 at most
+HISTOGRAM_SUB_BUCKETS = 32
+
+
+# Binary codec of session message payloads -----------------------------------
+# Payload starts with the codec version, the rest depends on the message:
+#   REQ_GM_SET_NAME    name: B length, UTF-8
+#   REQ_GM_SET_SUDOKU  complexity: B
+#   REQ_GM_GUESS       num, row, col: 3 x B
+#   REQ_GM_GET_STATE   nothing
+#   RSP_GM_STATE       board: 41 bytes, two cells per byte (high nibble first),
+#                      leaderboard: H entries, each name and i points
+#   RSP_GM_NOTIFY      text: H length, UTF-8
+CODEC_VERSION = 1
+CODEC_HEADER = struct.Struct('!B')
+GUESS_STRUCT = struct.Struct('!BBB')
+BOARD_CELLS = 81
+BOARD_BYTES = (BOARD_CELLS + 1) // 2
+_U8 = struct.Struct('!B')
+_U16 = struct.Struct('!H')
+_I32 = struct.Struct('!i')
+# Cell value <-> its hex digit, nibbles are packed by unhexlify in one go
+_NIBBLES = ''.join(chr(v) for v in range(16))
+_CELL_TO_HEX = string.maketrans(_NIBBLES, '0123456789abcdef')
+_HEX_TO_CELL = string.maketrans('0123456789abcdef', _NIBBLES)
+
+
+def pack_board(cells):
+    """
+    :param cells: 81 ints 0..9 (Board, bytearray or str of raw bytes)
+    :return: str, 41 bytes
+    """
+    cells = cells.tobytes() if hasattr(cells, 'tobytes') else str(bytearray(cells))
+    if len(cells) != BOARD_CELLS:
+        raise ValueError('Board needs %d cells, %d given' % (BOARD_CELLS, len(cells)))
+    if cells.translate(None, _NIBBLES[:10]):
+        raise ValueError('Board cell is out of range')
+    return unhexlify(cells.translate(_CELL_TO_HEX) + '0')
+
+
+def unpack_board(data, offset=0):
+    """
+    :return: bytearray, 81 cells
+    """
+    packed = data[offset:offset + BOARD_BYTES]
+    if len(packed) != BOARD_BYTES:
+        raise ValueError('Board is truncated')
+    digits = hexlify(packed)
+    if digits.translate(None, '0123456789'):
+        raise ValueError('Board cell is out of range')
+    return bytearray(digits.translate(_HEX_TO_CELL)[:BOARD_CELLS])
+
+
+def _pack_text(text, size):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    if len(text) >= 1 << (8 * size.size):
+        raise ValueError('Text of %d bytes is too long' % len(text))
+    return size.pack(len(text)) + text
+
+
+def _unpack_text(data, offset, size):
+    """
+    :return: (unicode, offset after the text)
+    """
+    n = size.unpack_from(data, offset)[0]
+    offset += size.size
+    if offset + n > len(data):
+        raise ValueError('Text is truncated')
+    return data[offset:offset + n].decode('utf-8'), offset + n
+
+
+def pack_leaderboard(table):
+    """
+    :param table: dict, name: points, or list of [name, points]
+    :return: str
+    """
+    if isinstance(table, dict):
+        table = table.items()
+    parts = [_U16.pack(len(table))]
+    for name, points in table:
+        parts.append(_pack_text(name, _U8))
+        parts.append(_I32.pack(points))
+    return ''.join(parts)
+
+
+def unpack_leaderboard(data, offset=0):
+    """
+    :return: (list of [name, points] in the order they were packed, offset after the table)
+    """
+    n = _U16.unpack_from(data, offset)[0]
+    offset += _U16.size
+    table = []
+    for _ in range(n):
+        name, offset = _unpack_text(data, offset, _U8)
+        table.append([name, _I32.unpack_from(data, offset)[0]])
+        offset += _I32.size
+    return table, offset
+
+
+def _pack_state(state):
+    board, leaderboard = state
+    return pack_board(board) + pack_leaderboard(leaderboard)
+
+
+def _unpack_state(data, offset):
+    board = unpack_board(data, offset)
+    table, offset = unpack_leaderboard(data, offset + BOARD_BYTES)
+    return (board, table), offset
+
+
+def _pack_guess(guess):
+    return GUESS_STRUCT.pack(*guess)
+
+
+def _unpack_guess(data, offset):
+    return GUESS_STRUCT.unpack_from(data, offset), offset + GUESS_STRUCT.size
+
+
+def _pack_complexity(complexity):
+    return _U8.pack(int(complexity))
+
+
+def _unpack_complexity(data, offset):
+    return _U8.unpack_from(data, offset)[0], offset + _U8.size
+
+
+# Message code: (encoder, decoder of the payload body)
+CODECS = {
+    REQ_GM_SET_NAME: (lambda name: _pack_text(name, _U8),
+                      lambda data, offset: _unpack_text(data, offset, _U8)),
+    REQ_GM_SET_SUDOKU: (_pack_complexity, _unpack_complexity),
+    REQ_GM_GUESS: (_pack_guess, _unpack_guess),
+    REQ_GM_GET_STATE: (lambda _: '', lambda data, offset: (None, offset)),
+    RSP_GM_STATE: (_pack_state, _unpack_state),
+    RSP_GM_NOTIFY: (lambda text: _pack_text(text, _U16),
+                    lambda data, offset: _unpack_text(data, offset, _U16)),
+}
+
+
+def serialize(kind, msg):
+    """
+    Encode payload of the session message
+    :param kind: str, message code, e.g. REQ_GM_GUESS
+    :param msg: message value, see CODECS for the types
+    :return: str
+    :raises ValueError: value does not fit the message format
+    """
+    try:
+        return CODEC_HEADER.pack(CODEC_VERSION) + CODECS[kind][0](msg)
+    except struct.error as e:
+        raise ValueError('Can not encode %r message: %s' % (kind, e))
+
+
+def deserialize(kind, payload):
+    """
+    Decode payload of the session message
+    :param kind: str, message code
+    :param payload: str, payload made by serialize
+    :return: message value
+    :raises ValueError: payload is malformed or made by another codec version
+    """
+    try:
+        version = CODEC_HEADER.unpack_from(payload)[0]
+        if version != CODEC_VERSION:
+            raise ValueError('Unsupported codec version %d' % version)
+        msg, offset = CODECS[kind][1](payload, CODEC_HEADER.size)
+    except struct.error as e:
+        raise ValueError('Malformed %r message: %s' % (kind, e))
+    if offset != len(payload):
+        raise ValueError('Malformed %r message: %d extra bytes' % (kind, len(payload) - offset))
+    return msg
+
+
+def pack_frames(*messages):
+    """
+    Length-prefixed frames of the messages gathered into one buffer,
+    so all of them go out with a single send
+    :return: str
+    """
+    parts = []
+    for m in messages:
+        parts.append(FRAME_HEADER.pack(len(m)))
+        parts.append(m)
+    return ''.join(parts)
+
+
+def send_frames(sock, *messages):
+    sock.sendall(pack_frames(*messages))
+
+
+class FrameReader(object):
+    """
+    Reads length-prefixed frames from a stream socket.
+    Data is received in bulk into one reusable buffer, a frame is cut
+    out of it once complete, the rest waits there for the next call
+    """
+
+    def __init__(self, sock, bufsize=DEFAULT_RCV_BUFSIZE):
+        self.sock = sock
+        self.__buf = bytearray(bufsize)
+        self.__view = memoryview(self.__buf)
+        self.__start = 0  # First byte not returned yet
+        self.__end = 0  # End of received data
+
+    def __reserve(self, size):
+        """
+        Make room for size bytes from the start of unread data
+        """
+        if self.__start + size <= len(self.__buf):
+            return
+        pending = self.__end - self.__start
+        if size > len(self.__buf):
+            buf = bytearray(max(size, 2 * len(self.__buf)))
+            buf[:pending] = self.__view[self.__start:self.__end]
+            self.__buf, self.__view = buf, memoryview(buf)
+        else:
+            # Move unread data to the front
+            self.__buf[:pending] = self.__buf[self.__start:self.__end]
+        self.__start, self.__end = 0, pending
+
+    def read(self):
+        """
+        Block until the next frame is received
+        :return: str, payload of the frame, None if connection was closed
+        :raises ValueError: frame is larger than MAX_FRAME_SIZE
+        """
+        while True:
+            pending = self.__end - self.__start
+            need = FRAME_HEADER.size
+            if pending >= need:
+                size = FRAME_HEADER.unpack_from(self.__buf, self.__start)[0]
+                if size > MAX_FRAME_SIZE:
+                    raise ValueError('Frame of %d bytes is too large' % size)
+                need += size
+                if pending >= need:
+                    first = self.__start + FRAME_HEADER.size
+                    self.__start += need
+                    if self.__start == self.__end:
+                        self.__start = self.__end = 0
+                    return self.__view[first:first + size].tobytes()
+            self.__reserve(need)
+            n = self.sock.recv_into(self.__view[self.__end:])
+            if not n:
+                return None
+            self.__end += n
+
+
+def pack_event(kind, version, name, cell=None, value=None, delta=0, points=None, board=None):
+    """
+    Encode game event for notification, every event carries the state version
+    it produced, so receivers can apply it to their copy of the state
+    :param cell: int, flat index of the changed cell
+    :param delta: int, change of the player's points
+    :param points: int, points of the player after the event
+    :param board: str, 81 digits of the new board
+    :return: str, one line
+    """
+    event = {'type': kind, 'version': version, 'name': name, 'delta': delta}
+    for k, v in (('cell', cell), ('value', value), ('points', points), ('board', board)):
+        if v is not None:
+            event[k] = v
+    return json.dumps(event, separators=(',', ':'))
+
 
-def serialize(msg):
-    #return encodestring(msg)
-    return pickle.dumps(msg)
+def unpack_event(line):
+    """
+    :return: dict, event encoded by pack_event, None if line is not an event
+    """
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or 'type' not in event or 'version' not in event:
+        return None
+    return event
 
 
-def deserialize(msg):
-    #return decodestring(msg)
-    return pickle.loads(msg)
+def room_group(room_id):
+    """
+    Multicast group of the room notifications, both sides derive it from room id
+    :return: str, IP address
+    """
+    h = zlib.crc32(room_id) & 0xFFFF
+    return '%s.%d.%d' % (DEFAULT_MULTICAST_PREFIX, h >> 8, h & 0xFF)
 
 
 def enum(**vals):
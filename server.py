@@ -1,16 +1,23 @@
-from threading import Thread, Lock, currentThread
-from socket import AF_INET, SOCK_STREAM, socket, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST
-from socket import IPPROTO_IP, IP_MULTICAST_TTL
+from threading import Thread, Lock, Condition, currentThread
+from socket import AF_INET, SOCK_STREAM, socket, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR
+from socket import IPPROTO_IP, IP_MULTICAST_TTL, IP_MULTICAST_LOOP
 from socket import error as soc_err
 from socket import gethostname, gethostbyname
+import select
 import struct
 import time
+from Queue import Queue, Empty, Full
+from collections import deque, namedtuple
+from contextlib import contextmanager
 
 from protocol import *
 from sudoku import *
+from leaderboard import Leaderboard
+from stats import LatencyHistogram, TimedLock
 
 from SimpleXMLRPCServer import SimpleXMLRPCServer
 from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
+from xmlrpclib import Binary
 
 import logging
 
@@ -20,47 +27,458 @@ LOG = logging.getLogger()
 
 class MyServerRequestHandler(SimpleXMLRPCRequestHandler):
     rpc_paths = ('/RPC2',)
+    # Socket timeout, a client that stalls mid-request does not hold the worker forever
+    timeout = DEFAULT_RPC_TIMEOUT
+
+
+class KeepAliveRequestHandler(MyServerRequestHandler):
+    """
+    Keeps HTTP/1.1 connections open between requests. Handles one request
+    per turn, the pool holds the connection until the next one arrives
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+
+
+class IdleConnections(Thread):
+    """
+    Keep-alive connections between requests. They wait here instead of
+    holding a worker: once the next request arrives the connection is
+    handed back to the pool like a newly accepted one
+    """
+
+    def __init__(self, ready, expired, timeout=DEFAULT_KEEPALIVE_TIMEOUT):
+        """
+        :param ready: callable(request, client_address), connection has data to read,
+                      should not block: every other idle connection waits meanwhile
+        :param expired: callable(request), connection should be closed
+        :param timeout: seconds a connection may stay idle
+        """
+        Thread.__init__(self, name='IdleConnectionsThread')
+        self.daemon = True
+        self.timeout = timeout
+        self.__ready = ready
+        self.__expired = expired
+        self.__lock = Lock()
+        self.__connections = {}  # fd: (request, client_address, deadline)
+        self.__running = True
+        # Datagram to itself wakes the thread up when a connection is added
+        self.__wakeup = socket(AF_INET, SOCK_DGRAM)
+        self.__wakeup.bind(('127.0.0.1', 0))
+        self.__wakeup.setblocking(0)
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__connections)
+
+    def add(self, request, client_address):
+        with self.__lock:
+            self.__connections[request.fileno()] = (request, client_address, time.time() + self.timeout)
+        self.__wake()
+
+    def stop(self):
+        self.__running = False
+        self.__wake()
+
+    def __wake(self):
+        try:
+            self.__wakeup.sendto('\0', self.__wakeup.getsockname())
+        except soc_err:
+            pass  # Wakes up on its own within a second
+
+    @staticmethod
+    def __wait(fds, timeout):
+        """
+        :return: list of readable fds
+        """
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            for fd in fds:
+                poller.register(fd, select.POLLIN)
+            return [fd for fd, _ in poller.poll(timeout * 1000)]
+        return select.select(fds, [], [], timeout)[0]
+
+    def run(self):
+        wakeup = self.__wakeup.fileno()
+        while self.__running:
+            with self.__lock:
+                fds = list(self.__connections)
+            try:
+                readable = self.__wait(fds + [wakeup], 1.0)
+            except select.error:
+                continue  # Interrupted by a signal
+            now = time.time()
+            ready, expired = [], []
+            with self.__lock:
+                for fd in readable:
+                    if fd in self.__connections:
+                        ready.append(self.__connections.pop(fd))
+                for fd, (request, _, deadline) in self.__connections.items():
+                    if deadline < now:
+                        expired.append(request)
+                        del self.__connections[fd]
+            if wakeup in readable:
+                try:
+                    while self.__wakeup.recv(64):
+                        pass
+                except soc_err:
+                    pass
+            # Closed connections are readable too, the worker finds them closed
+            for request, client_address, _ in ready:
+                self.__ready(request, client_address)
+            for request in expired:
+                self.__expired(request)
+        with self.__lock:
+            connections, self.__connections = self.__connections.values(), {}
+        for request, _, _ in connections:
+            self.__expired(request)
+        self.__wakeup.close()
+
+
+class ThreadPoolMixIn:
+    """
+    Mix-in for SocketServer to handle requests in a bounded pool of worker
+    threads: accepted connections are queued, at most `workers` are served
+    at the same time, so one slow client does not stall everyone else.
+    Workers that block for long (long polling) step aside with blocking(),
+    an extra worker takes their place until they are back.
+    Keep-alive connections do not hold a worker between requests, they
+    wait in IdleConnections for the next one
+    """
+    workers = DEFAULT_RPC_WORKERS
+    backlog = DEFAULT_RPC_BACKLOG
+    max_parked = DEFAULT_LONGPOLL_MAX  # Workers allowed to block at the same time
+    keepalive_timeout = DEFAULT_KEEPALIVE_TIMEOUT
+    max_idle = DEFAULT_KEEPALIVE_MAX
+
+    def start_workers(self):
+        self.__requests = Queue(self.backlog)
+        self.__idle = IdleConnections(self.__resume, self.shutdown_request, self.keepalive_timeout)
+        self.__idle.start()
+        self.__pool_lock = Lock()
+        self.__threads = 0  # Live workers, parked ones included
+        self.__parked = 0
+        self.__spawned = 0
+        with self.__pool_lock:
+            for _ in range(self.workers):
+                self.__spawn_worker()
+
+    def __spawn_worker(self):
+        # Pool lock should be held
+        t = Thread(name='RPCWorker-%d' % self.__spawned, target=self.__worker_loop)
+        t.daemon = True
+        self.__threads += 1
+        self.__spawned += 1
+        t.start()
+
+    def __worker_loop(self):
+        while True:
+            item = self.__requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            keep = False
+            try:
+                keep = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if keep and len(self.__idle) < self.max_idle:
+                    self.__idle.add(request, client_address)
+                else:
+                    self.shutdown_request(request)
+            with self.__pool_lock:
+                # Extra worker is not needed anymore once the parked one is back
+                if self.__threads - self.__parked > self.workers:
+                    self.__threads -= 1
+                    return
+
+    @contextmanager
+    def blocking(self):
+        """
+        Context for a request that blocks for long, yields False when too
+        many workers are blocked already (the request should not block then)
+        """
+        with self.__pool_lock:
+            allowed = self.__parked < self.max_parked
+            if allowed:
+                self.__parked += 1
+                if self.__threads - self.__parked < self.workers:
+                    self.__spawn_worker()
+        try:
+            yield allowed
+        finally:
+            if allowed:
+                with self.__pool_lock:
+                    self.__parked -= 1
+
+    def parked_workers(self):
+        """
+        :return: tuple, (live workers, blocked ones)
+        """
+        with self.__pool_lock:
+            return self.__threads, self.__parked
+
+    def process_request(self, request, client_address):
+        # Blocks the accepting loop when the backlog is full
+        self.__requests.put((request, client_address))
+
+    def __resume(self, request, client_address):
+        """
+        Hand idle connection with the next request back to the workers without
+        blocking the idle poller: when the backlog is full the connection is
+        closed, the client sends the request again over a new connection,
+        which waits to be accepted like any other
+        """
+        try:
+            self.__requests.put_nowait((request, client_address))
+        except Full:
+            logging.warn('Backlog is full, keep-alive connection of %s:%d closed' % client_address)
+            self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        """
+        :return: boolean, True if the connection stays open for the next request
+        """
+        handler = self.RequestHandlerClass(request, client_address, self)
+        return not getattr(handler, 'close_connection', True)
+
+    def server_close(self):
+        self.__idle.stop()
+        self.__idle.join()
+        with self.__pool_lock:
+            threads = self.__threads
+        for _ in range(threads):
+            self.__requests.put(None)
+
+
+class PooledXMLRPCServer(ThreadPoolMixIn, SimpleXMLRPCServer):
+    # Connections waiting in the listening socket
+    request_queue_size = DEFAULT_RPC_BACKLOG
+
+    def __init__(self, addr, workers=DEFAULT_RPC_WORKERS, **kwargs):
+        SimpleXMLRPCServer.__init__(self, addr, **kwargs)
+        self.workers = workers
+        self.start_workers()
+
+    def server_close(self):
+        ThreadPoolMixIn.server_close(self)
+        SimpleXMLRPCServer.server_close(self)
+
+
+class RoomNotFoundException(Exception):
+    def __init__(self, room_id):
+        Exception.__init__(self, 'Room %s does not exist!' % room_id)
+
+
+def multicast_socket():
+    """
+    Socket to send notifications to room multicast groups
+    """
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, struct.pack('b', DEFAULT_MULTICAST_TTL))
+    # Players on the hosting machine get notifications too
+    sock.setsockopt(IPPROTO_IP, IP_MULTICAST_LOOP, 1)
+    return sock
+
+
+class Notifier(Thread):
+    """
+    Sends game notifications from its own thread: events posted within
+    `window` seconds are merged into one datagram per room, so games only
+    queue events and never send while holding their lock.
+    Datagrams go to the multicast group of the room (see room_group)
+    """
+    def __init__(self, window=DEFAULT_NOTIFY_WINDOW):
+        Thread.__init__(self, name='NotifierThread')
+        self.daemon = True
+        self.window = window
+        self.__queue = Queue()
+
+        self.sender_sock = multicast_socket()
+
+        # Statistics
+        self.events = 0
+        self.datagrams = 0
+
+    def post(self, room_id, port, message):
+        self.__queue.put((room_id, port, message))
+
+    def stop(self):
+        self.__queue.put(None)
+
+    def run(self):
+        logging.info('Falling to notifier loop ...')
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+            # Collect everything posted within the window
+            batch = [item]
+            stopped = False
+            deadline = time.time() + self.window
+            while True:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.__queue.get(timeout=timeout)
+                except Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                batch.append(item)
+            self.__send(batch)
+            if stopped:
+                break
+        self.sender_sock.close()
+
+    def __send(self, batch):
+        rooms = {}
+        for room_id, port, message in batch:
+            rooms.setdefault((room_id, port), []).append(message)
+        for (room_id, port), messages in rooms.items():
+            self.events += len(messages)
+            if port is None:
+                logging.warn('Notification port of room %s is not set, notifications dropped' % room_id)
+                continue
+            group = room_group(room_id)
+            for datagram in self.__pack(room_id, messages):
+                try:
+                    self.sender_sock.sendto(datagram, (group, port))
+                    self.datagrams += 1
+                except soc_err as e:
+                    logging.error('Notification was not sent: %s' % e)
+
+    @staticmethod
+    def __pack(room_id, messages):
+        """
+        Join messages into datagrams that fit the receiver buffer. Message
+        that does not fit alone is dropped, receivers would get it cut:
+        clients notice the gap in versions and fetch it with get_events
+        """
+        head = room_id + MSG_FIELD_SEP
+        datagram = head
+        for m in messages:
+            if len(head) + len(m) > DEFAULT_RCV_BUFFSIZE:
+                logging.warn('Notification of %d bytes does not fit in a datagram, dropped' % len(m))
+                continue
+            if len(datagram) > len(head) and len(datagram) + len(MSG_EVENT_SEP) + len(m) > DEFAULT_RCV_BUFFSIZE:
+                yield datagram
+                datagram = head
+            datagram += (MSG_EVENT_SEP if len(datagram) > len(head) else '') + m
+        if len(datagram) > len(head):
+            yield datagram
+
+
+# Published state of the game, never changed after publishing:
+# readers take the latest one without locking. Scores are {name: points}
+# frozen by the writer
+GameSnapshot = namedtuple('GameSnapshot', 'version full_version board scores')
 
 
 class Game:
-    def __init__(self):
-        self.__gm_lock = Lock()
-        self.__scores = {}
+    # Methods available through RPC, every call is prefixed with room id
+    RPC_METHODS = ('check_name', 'set_new_sudoku', 'guess_number', 'get_current_state',
+                   'get_progress', 'get_changes', 'guess_numbers', 'get_top', 'get_rank',
+                   'get_events', 'wait_for_update')
+
+    def __init__(self, room_id=DEFAULT_ROOM):
+        self.room_id = room_id
+        self.__gm_lock = TimedLock()  # Measures waiting for the game and holding it
+        self.__updated = Condition(self.__gm_lock)  # Notified on every state change
+        self.__scores = Leaderboard()  # Players ranked by points
+        # Guards the leaderboard alone, so get_top and get_rank never wait for the game lock
+        self.__rank_lock = Lock()
         self.__players = []
-        self.__sudoku_to_guess = []
-        self.__sudoku_uncovered = []
+        self.__sudoku_to_guess = None  # Board, solution
+        self.__sudoku_uncovered = None  # Board, what players see
         self.__br_port = None
+        self.__pool = None  # PuzzlePool to take new sudoku from
+        self.__notifier = None  # Notifier to send notifications through
 
-        # broadcast sender socket
-        self.sender_sock = socket(AF_INET, SOCK_DGRAM)
-        self.sender_sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        # Progress counters, kept up to date on every guess
+        self.__cells_left = 0       # Cells not uncovered yet
+        self.__row_filled = [0] * 9  # Uncovered cells in every row
+        self.__col_filled = [0] * 9  # ... column
+        self.__box_filled = [0] * 9  # ... 3x3 box
+        self.__units_done = 0       # Rows, columns and boxes uncovered completely
+
+        # State version, bumped on every change of the board or the scores
+        self.__version = 0
+        self.__full_version = 0  # Board was replaced at this version, older clients need full state
+        self.__changes = deque(maxlen=DEFAULT_CHANGELOG_SIZE)  # (version, cell index or None, name or None)
+        self.__snapshot = GameSnapshot(0, 0, '', {})
+        # Notifications sent lately, to resend on request: (version, event)
+        self.__events = deque(maxlen=DEFAULT_CHANGELOG_SIZE)
 
-        # ttl = struct.pack('b', 1)
-        # self.sender_sock.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, ttl)
+        # multicast sender socket, opened on the first send when there is no notifier
+        self.sender_sock = None
+        # Statistics: notifications this room sent itself, one datagram each
+        self.sent = 0
+        self.__closed = False  # Room was closed, long polling requests should not wait
 
     def set_broadcast_port(self, port):
-        logging.info("Broadcast notifications will be sent to port %s" % port)
+        logging.info("Notifications will be sent to %s:%s" % (room_group(self.room_id), port))
         self.__br_port = port
 
-    def send_to_all(self, name, message):
-        logging.debug("Broadcast notification: %s - %s" % (name, message))
-        if message != 'EXIT':
-            self.sender_sock.sendto(name + ' ' + message, (DEFAULT_BROADCAST_ADDR, self.__br_port))
-        else:
+    def set_puzzle_pool(self, pool):
+        self.__pool = pool
+
+    def set_notifier(self, notifier):
+        self.__notifier = notifier
+
+    def get_lock_stats(self):
+        """
+        :return: dict, latency summaries of waiting for the game lock and holding it
+        """
+        return self.__gm_lock.stats()
+
+    def send_to_all(self, message):
+        logging.debug("Broadcast notification: %s" % message)
+        if self.__notifier is not None and message != 'EXIT':
+            self.__notifier.post(self.room_id, self.__br_port, message)
+        elif message != 'EXIT':
+            # Room tag lets clients skip notifications of other rooms
+            datagram = self.room_id + MSG_FIELD_SEP + message
+            if self.__br_port is None:
+                logging.warn('Notification port of room %s is not set, notification dropped' % self.room_id)
+            elif len(datagram) > DEFAULT_RCV_BUFFSIZE:
+                logging.warn('Notification of %d bytes does not fit in a datagram, dropped' % len(datagram))
+            else:
+                if self.sender_sock is None:
+                    self.sender_sock = multicast_socket()
+                self.sender_sock.sendto(datagram, (room_group(self.room_id), self.__br_port))
+                self.sent += 1
+        elif self.sender_sock is not None:
             self.sender_sock.close()
 
+    def close(self):
+        """
+        Tear the room down: wake up long polling requests, stop sending notifications
+        """
+        with self.__gm_lock:
+            self.__closed = True
+            self.__updated.notifyAll()
+        self.send_to_all('EXIT')
+
     def check_name(self, name):
         # Function for RPC
         # (copy from self.join, added PlayerSession)
         #players = map(lambda x: x.getName(), self.__players)
-        if name in self.__players:
-            return False
-        # ??? do we need PlayerSession?
-        #client_session = PlayerSession(name,self)
-        self.__players.append(name)
-        self.send_to_all(name, 'joined the game!')
-        self.__scores[name] = 0
-        #self.__notify_update('joined game!')
+        with self.__gm_lock:
+            if name in self.__players:
+                return False
+            # ??? do we need PlayerSession?
+            #client_session = PlayerSession(name,self)
+            self.__players.append(name)
+            self.__set_points(name, 0)
+            self.__commit(EVT_JOIN, name)
+            #self.__notify_update('joined game!')
         return True
 
     #def __notify_update(self, message):
@@ -87,76 +505,332 @@ class Game:
 
     def set_new_sudoku(self, name, complexity):
         # Function for RPC
+        complexity = int(complexity)
+        with self.__gm_lock:
+            if self.__sudoku_to_guess is not None:
+                return False
+        # Generate (or take ready one) without holding the lock,
+        # guesses and state reads go on meanwhile
+        if self.__pool is not None:
+            sudoku = self.__pool.get(complexity)
+        else:
+            sudoku = get_sudoku(complexity)
         r = False
         with self.__gm_lock:
-            if len(self.__sudoku_to_guess) <= 0:
-                sudoku = get_sudoku(int(complexity))
+            if self.__sudoku_to_guess is None:
                 self.__sudoku_to_guess = sudoku["s"]
                 self.__sudoku_uncovered = sudoku["u"]
-                self.send_to_all(name, 'did set new sudoku to guess!')
+                self.__count_progress()
+                self.__commit_board(EVT_NEW, name)
                 r = True
+        if not r and self.__pool is not None:
+            # Someone was faster, keep the puzzle for the next game
+            self.__pool.put(complexity, sudoku)
         return r
 
-    def __reset(self):
-        self.__sudoku_to_guess = []
-        self.__sudoku_uncovered = []
+    def reset(self, name=None):
+        """
+        Remove the current board the way solving it does, players keep their points.
+        Not available through RPC
+        :return: boolean, False if there was no board
+        """
+        with self.__gm_lock:
+            if self.__sudoku_to_guess is None:
+                return False
+            self.__reset(name)
+            return True
+
+    def __reset(self, name):
+        self.__sudoku_to_guess = None
+        self.__sudoku_uncovered = None
+        self.__count_progress()
+        self.__commit_board(EVT_SOLVED, name)
+
+    def __commit(self, kind, name, cell=None, delta=0):
+        """
+        Bump state version, log changed cell (flat index) and score of player,
+        notify everyone about the event
+        """
+        self.__version += 1
+        self.__changes.append((self.__version, cell, name))
+        self.__publish()
+        value = self.__sudoku_uncovered[cell] if cell is not None else None
+        self.__send_event(pack_event(kind, self.__version, name, cell=cell, value=value,
+                                     delta=delta, points=self.__scores.get(name)))
+
+    def __commit_board(self, kind, name):
+        """
+        Bump state version after the whole board was replaced (or removed),
+        notify everyone, new board goes with the notification
+        """
+        self.__version += 1
+        self.__full_version = self.__version
+        self.__changes.clear()
+        # Scores stay the same, no need to copy them
+        self.__publish(scores_changed=False)
+        board = None
+        if self.__sudoku_uncovered is not None:
+            board = ''.join(str(v) for v in self.__sudoku_uncovered)
+        self.__send_event(pack_event(kind, self.__version, name, board=board))
+
+    def __send_event(self, event):
+        self.__events.append((self.__version, event))
+        self.send_to_all(event)
+
+    def __publish(self, scores_changed=True):
+        """
+        Replace the snapshot with a copy of the current state, the game lock should be held
+        """
+        board = self.__sudoku_uncovered.tobytes() if self.__sudoku_uncovered is not None else ''
+        scores = self.__scores.scores() if scores_changed else self.__snapshot.scores
+        self.__snapshot = GameSnapshot(self.__version, self.__full_version, board, scores)
+        # Wake up long polling requests
+        self.__updated.notifyAll()
+
+    def __set_points(self, name, points):
+        """
+        Change points of the player in the leaderboard, the game lock should be held
+        """
+        with self.__rank_lock:
+            self.__scores.set(name, points)
+
+    def __count_progress(self):
+        """
+        Recount progress counters from scratch (new board only)
+        """
+        self.__cells_left = 0
+        self.__row_filled = [0] * 9
+        self.__col_filled = [0] * 9
+        self.__box_filled = [0] * 9
+        self.__units_done = 0
+        if self.__sudoku_uncovered is None:
+            return
+        for i, v in enumerate(self.__sudoku_uncovered):
+            r, c = divmod(i, 9)
+            if v:
+                self.__row_filled[r] += 1
+                self.__col_filled[c] += 1
+                self.__box_filled[r // 3 * 3 + c // 3] += 1
+            else:
+                self.__cells_left += 1
+        self.__units_done = sum(1 for n in self.__row_filled + self.__col_filled + self.__box_filled if n == 9)
+
+    def __uncover(self, r, c):
+        """
+        Update progress counters when cell [r][c] gets uncovered
+        """
+        self.__cells_left -= 1
+        for units, i in ((self.__row_filled, r), (self.__col_filled, c), (self.__box_filled, r // 3 * 3 + c // 3)):
+            units[i] += 1
+            if units[i] == 9:
+                self.__units_done += 1
+
+    @staticmethod
+    def __check_guess(num, row, col):
+        """
+        Reject a guess outside of the board before any counter is touched
+        :raises ValueError: malformed guess
+        """
+        if not all(isinstance(v, int) for v in (num, row, col)) or not (0 <= row < 9 and 0 <= col < 9):
+            raise ValueError('Malformed guess %r, [num, row, col] expected' % ([num, row, col],))
+
+    def __guess(self, num, row, col, name):
+        """
+        Check one guess, the game lock should be held
+        :return: boolean, True if number is right
+        :raises ValueError: malformed guess
+        """
+        self.__check_guess(num, row, col)
+        if self.__sudoku_to_guess is None:
+            # Board was solved (or not set yet), nothing to guess
+            return False
+        if name not in self.__scores:
+            # Only players who joined with check_name play
+            return False
+        r = False
+        cell = (row, col)
+        if num == self.__sudoku_to_guess[cell]:
+            if not self.__sudoku_uncovered[cell]:
+                self.__uncover(row, col)
+            self.__sudoku_uncovered[cell] = num
+            r = True
+            self.__set_points(name, self.__scores.get(name) + 1)
+            self.__commit(EVT_GUESS, name, cell=row * 9 + col, delta=1)
+            logging.debug(self.__scores.top(DEFAULT_LEADERBOARD_SIZE))
+        else:
+            self.__set_points(name, self.__scores.get(name) - 1)
+            self.__commit(EVT_MISS, name, delta=-1)
+            logging.debug(self.__scores.top(DEFAULT_LEADERBOARD_SIZE))
+        if self.__cells_left == 0:
+            # sud = self.__sudoku_to_guess
+            self.__reset(name)
+        return r
 
     def guess_number(self, num, pos,name):
         # Function for RPC
+        row, col = pos
         with self.__gm_lock:
-            r = False
-            if num == self.__sudoku_to_guess[pos[0]][pos[1]]:
-                self.__sudoku_uncovered[pos[0]][pos[1]] = num
-                self.send_to_all(name, 'did guess %i in position [%i][%i]!' % (num,pos[0],pos[1]))
-                r = True
-                self.__scores[name] = self.__scores[name] + 1
-                logging.debug(self.__scores)
-            else:
-                self.__scores[name] = self.__scores[name] - 1
-                logging.debug(self.__scores)
-            if self.__sudoku_uncovered == self.__sudoku_to_guess:
-                # sud = self.__sudoku_to_guess
-                self.__reset()
-                self.send_to_all(name, 'did solve the sudoku')
+            r = self.__guess(num, row, col, name)
         return r
 
+    def guess_numbers(self, guesses, name):
+        """
+        Check a batch of guesses under one lock acquisition
+        :param guesses: list of [num, row, col], MAX_GUESS_BATCH at most
+        :return: dict, {'results': list of booleans, 'version': state version after the batch}
+        :raises ValueError: batch is too large or has a malformed guess
+        """
+        # Function for RPC
+        if len(guesses) > MAX_GUESS_BATCH:
+            raise ValueError('Batch of %d guesses, %d at most' % (len(guesses), MAX_GUESS_BATCH))
+        # Malformed entry fails the whole batch before any guess is applied
+        for guess in guesses:
+            if not isinstance(guess, (list, tuple)) or len(guess) != 3:
+                raise ValueError('Malformed guess %r, [num, row, col] expected' % (guess,))
+            self.__check_guess(*guess)
+        with self.__gm_lock:
+            results = [self.__guess(num, row, col, name) for num, row, col in guesses]
+            return {'results': results, 'version': self.__version}
+
     def set_name(self, name):
-        self.__scores[name] = 0
+        with self.__gm_lock:
+            self.__set_points(name, 0)
+            self.__commit(EVT_JOIN, name)
 
     def get_current_state(self):
         """
         Returns unsolved sudoku and leaderboard
         """
+        # No locking: snapshot is replaced as a whole, never changed in place
+        snapshot = self.__snapshot
+        # Board goes out as 81 raw bytes, empty when there is no game
+        return Binary(snapshot.board), snapshot.scores
+
+    def get_top(self, k=DEFAULT_LEADERBOARD_SIZE):
+        """
+        Returns first k players of the leaderboard, list of [name, points], best first
+        """
+        # O(log n + k) in the leaderboard, the game lock is not taken
+        with self.__rank_lock:
+            return self.__scores.top(k)
+
+    def get_rank(self, name):
+        """
+        Returns place of the player (from 1) and points, [0, 0] for unknown player
+        """
+        with self.__rank_lock:
+            return [self.__scores.rank(name), self.__scores.get(name, 0)]
+
+    def get_progress(self):
+        """
+        Returns progress of the current sudoku without scanning the board:
+        cells left, uncovered cells per row, column and box, finished units
+        """
+        with self.__gm_lock:
+            return {'cells_left': self.__cells_left,
+                    'rows': list(self.__row_filled),
+                    'cols': list(self.__col_filled),
+                    'boxes': list(self.__box_filled),
+                    'units_done': self.__units_done}
+
+    def get_changes(self, since_version):
+        """
+        Returns changes of the state made after given version:
+        {'version', 'modified': False} if nothing changed,
+        {'version', 'modified', 'full': False, 'cells': [[index, value], ...], 'scores': {name: points}}
+        with changed cells and scores only, or
+        {'version', 'modified', 'full': True, 'board': 81 bytes, 'scores': {name: points}}
+        if the board was replaced or the changes are not logged anymore
+        """
+        # Answer from the snapshot when possible, only deltas need the log
+        snapshot = self.__snapshot
+        if since_version == snapshot.version:
+            return {'version': snapshot.version, 'modified': False}
+        if since_version < snapshot.full_version or since_version > snapshot.version:
+            return self.__full_changes(snapshot)
         with self.__gm_lock:
-            # s = self.__uncovered
-            s = self.__sudoku_uncovered
-            l = self.__scores
-        return s, l
+            # Board could be replaced meanwhile, check again
+            changes = self.__changes
+            if since_version < self.__full_version or \
+                    (len(changes) == changes.maxlen and since_version < changes[0][0]):
+                return self.__full_changes(self.__snapshot)
+            cells, names = set(), set()
+            for version, cell, name in reversed(changes):
+                if version <= since_version:
+                    break
+                if cell is not None:
+                    cells.add(cell)
+                if name is not None:
+                    names.add(name)
+            return {'version': self.__version, 'modified': True, 'full': False,
+                    'cells': [[i, self.__sudoku_uncovered[i]] for i in sorted(cells)],
+                    'scores': dict((n, self.__scores.get(n)) for n in names)}
+
+    def wait_for_update(self, since_version, timeout=DEFAULT_LONGPOLL_TIMEOUT):
+        """
+        Long polling: wait until the state changes after given version or
+        timeout (seconds, at most DEFAULT_LONGPOLL_TIMEOUT) passes
+        :return: dict, same as get_changes
+        :raises RoomNotFoundException: room was closed meanwhile
+        """
+        deadline = time.time() + max(0, min(float(timeout), DEFAULT_LONGPOLL_TIMEOUT))
+        with self.__updated:
+            while self.__version == since_version and not self.__closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__updated.wait(remaining)
+            if self.__closed:
+                raise RoomNotFoundException(self.room_id)
+        return self.get_changes(since_version)
+
+    def get_events(self, since_version):
+        """
+        Returns notifications sent after given version, to recover the missed ones:
+        {'available': True, 'events': list of events in order}, or
+        {'available': False, 'events': []} if they are not kept anymore
+        """
+        with self.__gm_lock:
+            events = self.__events
+            if since_version > self.__version or (events and since_version < events[0][0] - 1) or \
+                    (not events and since_version != self.__version):
+                return {'available': False, 'events': []}
+            missed = [e for v, e in events if v > since_version]
+        return {'available': True, 'events': missed}
+
+    def __full_changes(self, snapshot):
+        return {'version': snapshot.version, 'modified': True, 'full': True,
+                'board': Binary(snapshot.board), 'scores': snapshot.scores}
 
 
-#can delete
 class PlayerSession(Thread):
-    def __init__(self, game, name):
+    """
+    Game session of a client connected over raw TCP socket instead of RPC.
+    Requests and responses travel as length-prefixed frames
+    """
+    def __init__(self, soc, soc_addr, game):
         Thread.__init__(self)
-        #self.__s = soc
-        #self.__addr = soc_addr
+        self.__s = soc
+        self.__addr = soc_addr
+        self.__reader = FrameReader(soc)
         self.__send_lock = Lock()
         self.__game = game
-        self.__name = name
+        self.__name = None
 
     def getName(self):
         return self.__name
 
     def __join(self, name, game):
-        self.__name = name
-        ok = game.join(name,self)
+        ok = game.check_name(name)
+        if ok:
+            self.__name = name
         return self.__reply_join(ok)
 
     def __reply_join(self,ok):
         return RSP_GM_SET_NAME+MSG_FIELD_SEP+('1' if ok else '0')
 
     def is_joined(self):
-        return self.__game != None
+        return self.__name is not None
 
     def __reply_err_not_joined(self):
         return RSP_GM_NOT_JOINED+MSG_FIELD_SEP
@@ -170,35 +844,37 @@ class PlayerSession(Thread):
     def __set_new_sudoku(self, complexity):
         if not self.is_joined():
             return self.__reply_err_not_joined()
-        return self.__reply_set_new_sudoku(self.__game.set_new_sudoku(complexity))
+        return self.__reply_set_new_sudoku(self.__game.set_new_sudoku(self.__name, complexity))
 
-    def __guess_number(self, num, pos, name):
+    def __guess_number(self, num, pos):
         if not self.is_joined():
             return self.__reply_err_not_joined()
-        return self.__reply_guess_number(self.__game.guess_number(num, pos, name))
+        return self.__reply_guess_number(self.__game.guess_number(num, pos, self.__name))
 
     def __current_state(self):
         if not self.is_joined():
             return self.__reply_err_not_joined()
-        return RSP_GM_STATE + MSG_FIELD_SEP + serialize(self.__game.get_current_state())
+        board, scores = self.__game.get_current_state()
+        # Empty board when there is no game
+        cells = board.data or '\0' * BOARD_CELLS
+        return RSP_GM_STATE + MSG_FIELD_SEP + serialize(RSP_GM_STATE, (cells, scores))
 
     def __session_rcv(self):
-        m, b = '', ''
+        m = ''
         try:
-            b = self.__s.recv(DEFAULT_RCV_BUFSIZE)
-            m += b
-            while len(b) > 0 and not (b.endswith(MSG_SEP)):
-                b = self.__s.recv(DEFAULT_RCV_BUFSIZE)
-                m += b
-            if len(b) <= 0:
+            m = self.__reader.read()
+            if m is None:
                 self.__s.close()
                 LOG.info('Client %s:%d disconnected' % self.__addr)
                 m = ''
-            m = m[:-1]
         except KeyboardInterrupt:
             self.__s.close()
             LOG.info('Ctrl+C issued, disconnecting client %s:%d' % self.__addr)
             m = ''
+        except ValueError as e:
+            LOG.warn('Client %s:%d sent malformed frame: %s' % (self.__addr + (e,)))
+            self.__s.close()
+            m = ''
         except soc_err as e:
             if e.errno == 107:
                 LOG.warn( 'Client %s:%d left before server could handle it' %  self.__addr)
@@ -217,22 +893,20 @@ class PlayerSession(Thread):
         payload = message[2:]
 
         if message.startswith(REQ_GM_SET_NAME + MSG_FIELD_SEP):
-            name = deserialize(payload)
-            self.__game.set_name(name)
+            name = deserialize(REQ_GM_SET_NAME, payload)
             LOG.debug('Client %s:%d will use name %s' % (self.__addr+(name,)))
             rsp = self.__join(name, self.__game)
 
         elif message.startswith(REQ_GM_SET_SUDOKU + MSG_FIELD_SEP):
-            complexity = deserialize(payload)
+            complexity = deserialize(REQ_GM_SET_SUDOKU, payload)
             LOG.debug('Client %s:%d wants to set new sudoku with complexity %s' % (self.__addr+(complexity,)))
             rsp = self.__set_new_sudoku(complexity)
 
         elif message.startswith(REQ_GM_GUESS + MSG_FIELD_SEP):
-            user_input = deserialize(payload)
-            num, pos, name = user_input
-            pos = [int(x) for x in pos]
+            num, row, col = deserialize(REQ_GM_GUESS, payload)
+            pos = [row, col]
             LOG.debug('Client %s:%d proposes number %s' % (self.__addr+(num,)))
-            rsp = self.__guess_number(num, pos, name)
+            rsp = self.__guess_number(num, pos)
 
         elif message.startswith(REQ_GM_GET_STATE + MSG_FIELD_SEP):
             LOG.debug('Client %s:%d asks for current uncovered sudoku' % self.__addr)
@@ -243,12 +917,11 @@ class PlayerSession(Thread):
             rsp = RSP_UNKNCONTROL
         return rsp
 
-    def __session_send(self, msg):
-        m = msg + MSG_SEP
+    def __session_send(self, *msgs):
         with self.__send_lock:
             r = False
             try:
-                self.__s.sendall(m)
+                send_frames(self.__s, *msgs)
                 r = True
             except KeyboardInterrupt:
                 self.__s.close()
@@ -263,7 +936,7 @@ class PlayerSession(Thread):
             return r
 
     def notify(self, message):
-        payload = serialize(message)
+        payload = serialize(RSP_GM_NOTIFY, message)
         self.__session_send(RSP_GM_NOTIFY+MSG_FIELD_SEP+payload)
 
     def run(self):
@@ -271,20 +944,187 @@ class PlayerSession(Thread):
             m = self.__session_rcv()
             if len(m) <= 0:
                 break
-            rsp = self.__protocol_rcv(m)
+            try:
+                rsp = self.__protocol_rcv(m)
+            except ValueError as e:
+                LOG.warn('Client %s:%d sent malformed request: %s' % (self.__addr + (e,)))
+                rsp = RSP_BADFORMAT
             if rsp == RSP_BADFORMAT:
+                self.__s.close()
                 break
             if not self.__session_send(rsp):
                 break
-        self.__game.remove_me()
+
+
+class RoomRegistry:
+    """
+    Registry of game rooms served by one GameServer.
+    Every room has its own Game (and its own lock), so players of one room
+    never wait for players of another one.
+    Room-scoped RPC calls take room id as the first parameter:
+    guess_number(room_id, num, pos, name)
+    """
+    # Methods of the registry itself available through RPC
+    RPC_METHODS = ('create_room', 'close_room', 'list_rooms', 'get_pool_stats', 'get_stats')
+
+    def __init__(self, pool=None, notifier=None, max_rooms=DEFAULT_MAX_ROOMS):
+        self.__rooms_lock = Lock()
+        self.__rooms = {}
+        self.max_rooms = max_rooms
+        self.__br_port = None
+        self.pool = pool  # PuzzlePool shared by all rooms
+        self.notifier = notifier  # Notifier shared by all rooms
+        # Context to wrap long blocking calls in (ThreadPoolMixIn.blocking), None - no wrapping
+        self.blocking = None
+        # Notifications sent by rooms that are closed by now
+        self.__closed_sent = 0
+        # Time every RPC method takes, all rooms together
+        self.timings = dict((m, LatencyHistogram()) for m in self.RPC_METHODS + Game.RPC_METHODS)
+
+    def set_broadcast_port(self, port):
+        with self.__rooms_lock:
+            self.__br_port = port
+            for game in self.__rooms.values():
+                game.set_broadcast_port(port)
+
+    def add_room(self, game):
+        """
+        Register already created game as a room
+        :param game: Game
+        :return: boolean, False if room id is taken or there are max_rooms rooms already
+        """
+        with self.__rooms_lock:
+            if game.room_id in self.__rooms or len(self.__rooms) >= self.max_rooms:
+                return False
+            if self.__br_port is not None:
+                game.set_broadcast_port(self.__br_port)
+            if self.pool is not None:
+                game.set_puzzle_pool(self.pool)
+            if self.notifier is not None:
+                game.set_notifier(self.notifier)
+            self.__rooms[game.room_id] = game
+        logging.info("Room %s was created" % game.room_id)
+        return True
+
+    def get_room(self, room_id):
+        with self.__rooms_lock:
+            game = self.__rooms.get(room_id)
+        if game is None:
+            raise RoomNotFoundException(room_id)
+        return game
+
+    def create_room(self, room_id):
+        # Function for RPC
+        room_id = str(room_id)
+        if not room_id or len(room_id) > MAX_ROOM_ID_LENGTH or MSG_FIELD_SEP in room_id:
+            return False
+        with self.__rooms_lock:
+            if room_id in self.__rooms:
+                return False
+        return self.add_room(Game(room_id))
+
+    def close_room(self, room_id):
+        # Function for RPC
+        if room_id == DEFAULT_ROOM:
+            # Clients join it unless told otherwise, it stays
+            return False
+        with self.__rooms_lock:
+            game = self.__rooms.pop(room_id, None)
+        if game is None:
+            return False
+        game.close()
+        with self.__rooms_lock:
+            self.__closed_sent += game.sent
+        logging.info("Room %s was closed" % room_id)
+        return True
+
+    def list_rooms(self):
+        # Function for RPC
+        with self.__rooms_lock:
+            return sorted(self.__rooms.keys())
+
+    def get_pool_stats(self):
+        # Function for RPC
+        if self.pool is None:
+            return {}
+        return self.pool.stats()
+
+    def get_stats(self):
+        # Function for RPC
+        """
+        :return: dict, latencies of RPC methods that were called, game lock waiting
+                 and holding per room, notifications sent, puzzle pool
+        """
+        with self.__rooms_lock:
+            rooms = self.__rooms.items()
+        # Rooms send themselves when there is no notifier
+        sent = self.__closed_sent + sum(game.sent for _, game in rooms)
+        notifications = {'events': sent, 'datagrams': sent}
+        if self.notifier is not None:
+            notifications['events'] += self.notifier.events
+            notifications['datagrams'] += self.notifier.datagrams
+        return {'rpc': dict((m, h.summary()) for m, h in self.timings.items() if h.count),
+                'locks': dict((room_id, game.get_lock_stats()) for room_id, game in rooms),
+                'notifications': notifications,
+                'pool': self.get_pool_stats()}
+
+    def _listMethods(self):
+        return list(self.RPC_METHODS + Game.RPC_METHODS)
+
+    def _dispatch(self, method, params):
+        """
+        Route RPC call either to the registry or to the game of the room, time it
+        """
+        timing = self.timings.get(method)
+        if timing is None:
+            return self.__route(method, params)
+        start = time.time()
+        try:
+            return self.__route(method, params)
+        finally:
+            timing.record(time.time() - start)
+
+    def __route(self, method, params):
+        if method in self.RPC_METHODS:
+            return getattr(self, method)(*params)
+        if method in Game.RPC_METHODS:
+            if len(params) < 1:
+                raise TypeError('Room id is required for %s' % method)
+            game = self.get_room(params[0])
+            if method == 'wait_for_update':
+                # Waiting would stall single-threaded server, answer right away then
+                if self.blocking is not None:
+                    with self.blocking() as allowed:
+                        if allowed:
+                            return game.wait_for_update(*params[1:])
+                # ... as well as when too many requests wait already
+                return game.get_changes(*params[1:2])
+            return getattr(game, method)(*params[1:])
+        raise Exception('method "%s" is not supported' % method)
 
 
 class GameServer:
-    def __init__(self, game):
+    def __init__(self, game=None, workers=DEFAULT_RPC_WORKERS, notify_window=DEFAULT_NOTIFY_WINDOW,
+                 keepalive=True, max_rooms=DEFAULT_MAX_ROOMS):
         self.__clients = []
-        self.__game = game
+        # Number of threads serving RPC, 0 serves requests one by one
+        self.workers = workers
+        # Keep connections of the pooled server open between requests
+        self.keepalive = keepalive
+        self.pool = PuzzlePool()
+        # Notifications posted within notify_window seconds go out in one datagram
+        self.notifier = Notifier(notify_window)
+        # Rooms hosted at most, the default one included
+        self.rooms = RoomRegistry(self.pool, self.notifier, max_rooms)
+        # The game passed on creation becomes the default room
+        if game is None:
+            game = Game()
+        self.rooms.add_room(game)
         self.server_sock = None
         self.server = None
+        # Raw TCP game sessions, off unless session_port is set before listen()
+        self.session_port = None
+        self.session_sock = None
 
         # broadcast sender socket
         self.sender_sock = socket(AF_INET, SOCK_DGRAM)
@@ -292,9 +1132,39 @@ class GameServer:
 
         self.port = None
         self.ip = None
+        # Seconds between statistics lines in the log, 0 - no lines
+        self.stats_interval = DEFAULT_STATS_INTERVAL
 
     def set_broadcast_port(self, port):
-        self.__game.set_broadcast_port(port)
+        self.rooms.set_broadcast_port(port)
+
+    def stats_line(self):
+        """
+        Statistics in one line: p50/p99/max of RPC methods and of the game
+        locks in milliseconds, notifications and puzzle pool counters
+        """
+        stats = self.rooms.get_stats()
+        parts = ['%s %d calls %.2f/%.2f/%.2f' % (m, s['count'], s['p50_ms'], s['p99_ms'], s['max_ms'])
+                 for m, s in sorted(stats['rpc'].items())]
+        for room_id, lock in sorted(stats['locks'].items()):
+            parts.append('lock %s wait %.2f/%.2f/%.2f hold %.2f/%.2f/%.2f' % (
+                room_id, lock['wait']['p50_ms'], lock['wait']['p99_ms'], lock['wait']['max_ms'],
+                lock['hold']['p50_ms'], lock['hold']['p99_ms'], lock['hold']['max_ms']))
+        parts.append('notifications %(events)d events %(datagrams)d datagrams' % stats['notifications'])
+        if stats['pool']:
+            parts.append('pool %(hits)d hits %(misses)d misses' % stats['pool'])
+        return 'Stats (p50/p99/max ms): ' + ' | '.join(parts)
+
+    def stats_loop(self):
+        while True:
+            time.sleep(self.stats_interval)
+            LOG.info(self.stats_line())
+
+    def create_room(self, room_id):
+        return self.rooms.create_room(room_id)
+
+    def close_room(self, room_id):
+        return self.rooms.close_room(room_id)
 
     def listen(self):
         # Create XML server
@@ -303,21 +1173,56 @@ class GameServer:
             return
 
         self.server_sock = (DEFAULT_HOSTING_ADDR, self.port)
-        self.server = SimpleXMLRPCServer(self.server_sock, requestHandler=MyServerRequestHandler)
-        LOG.debug('Server started listening RPC on %s:%s' % self.server_sock)
+        if self.workers > 0:
+            # Only the pool keeps connections open, an idle one would block a single-threaded server
+            handler = KeepAliveRequestHandler if self.keepalive else MyServerRequestHandler
+            self.server = PooledXMLRPCServer(self.server_sock,
+                                             workers=self.workers,
+                                             requestHandler=handler)
+        else:
+            self.server = SimpleXMLRPCServer(self.server_sock, requestHandler=MyServerRequestHandler)
+        LOG.debug('Server started listening RPC on %s:%s (%d workers)' % (self.server_sock + (self.workers,)))
         self.server.register_introspection_functions()
+        # Several calls in one request, e.g. a guess and the changes it made
+        self.server.register_multicall_functions()
         # Register all functions
-        # Register server-side functions into RPC middleware
-        self.server.register_instance(self.__game)
+        # Register server-side functions into RPC middleware,
+        # the registry routes room-scoped calls to the games
+        self.server.register_instance(self.rooms)
         # self.server.register_function(function_name)
+        if self.workers > 0:
+            # Long polling requests do not take workers from other requests
+            self.rooms.blocking = self.server.blocking
 
-    # def listen(self, sock_addr, backlog=1):
-    #     self.__sock_addr = sock_addr
-    #     self.__backlog = backlog
-    #     self.__s = socket(AF_INET, SOCK_STREAM)
-    #     self.__s.bind(self.__sock_addr)
-    #     self.__s.listen(self.__backlog)
-    #     LOG.debug('Socket %s:%d is in listening state' % self.__s.getsockname() )
+        if self.session_port:
+            self.listen_sessions(self.session_port)
+
+        # Start generating puzzles and sending notifications in background
+        self.pool.start()
+        self.notifier.start()
+
+    def listen_sessions(self, port, backlog=DEFAULT_RPC_BACKLOG):
+        """
+        Accept game sessions over raw TCP besides RPC, they play in the default room
+        :param port: int, port to listen
+        """
+        self.session_sock = socket(AF_INET, SOCK_STREAM)
+        self.session_sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.session_sock.bind((DEFAULT_HOSTING_ADDR, port))
+        self.session_sock.listen(backlog)
+        LOG.debug('Socket %s:%d is in listening state' % self.session_sock.getsockname())
+
+    def sessions_loop(self):
+        LOG.info('Awaiting new clients ...')
+        while True:
+            try:
+                client_socket, client_addr = self.session_sock.accept()
+            except soc_err:
+                # Listening socket was closed
+                break
+            c = PlayerSession(client_socket, client_addr, self.rooms.get_room(DEFAULT_ROOM))
+            c.daemon = True
+            c.start()
 
     def broadcast_ip_loop(self):
         message = self.ip + MSG_FIELD_SEP + str(self.port)
@@ -331,30 +1236,21 @@ class GameServer:
 
     def loop(self):
         LOG.info('Falling to serving loop, press Ctrl+C to terminate...')
-        # clients = []
-        # client_socket = None
-        #
-        # try:
-        #     while True:
-        #         client_socket = None
-        #         LOG.info('Awaiting new clients ...')
-        #         client_socket, client_addr = self.__s.accept()
-        #         c = PlayerSession(client_socket, client_addr, self.__game)
-        #         clients.append(c)
-        #         c.start()
-        # except KeyboardInterrupt:
-        #     LOG.warn('Ctrl+C issued closing server ...')
-        # finally:
-        #     if client_socket is not None:
-        #         client_socket.close()
-        #     self.__s.close()
-        # map(lambda x: x.join(), clients)
+        if self.session_sock is not None:
+            sessions_thread = Thread(name='SessionsThread', target=self.sessions_loop)
+            sessions_thread.daemon = True
+            sessions_thread.start()
 
         # Start broadcasting my IP for automatic discovery
         broadcast_ip_thread = Thread(name='BroadcastIPThread', target=self.broadcast_ip_loop)
         broadcast_ip_thread.daemon = True  # Make this thread close with the main thread
         broadcast_ip_thread.start()
 
+        if self.stats_interval:
+            stats_thread = Thread(name='StatsThread', target=self.stats_loop)
+            stats_thread.daemon = True
+            stats_thread.start()
+
         try:
             self.server.serve_forever()
         except KeyboardInterrupt:
@@ -362,6 +1258,10 @@ class GameServer:
         finally:
             self.server.shutdown()  # Stop the serve-forever loop
             self.server.server_close()  # Close the sockets
+            self.pool.stop()
+            self.notifier.stop()
+            if self.session_sock is not None:
+                self.session_sock.close()
         print 'Terminating ...'
 
 
@@ -0,0 +1,110 @@
+from threading import Lock
+from thread import get_ident
+import time
+
+from protocol import HISTOGRAM_SUB_BUCKETS
+
+
+class LatencyHistogram(object):
+    """
+    Latencies in log-linear buckets the way HdrHistogram keeps them: every
+    power of two of microseconds is split into HISTOGRAM_SUB_BUCKETS equal
+    buckets, so a value comes back with the same relative error whether
+    it is 10us or 10s, and memory does not grow with the number of values
+    """
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, sub_buckets=HISTOGRAM_SUB_BUCKETS):
+        self.__lock = Lock()
+        self.__bits = sub_buckets.bit_length() - 1
+        self.__counts = []
+        self.count = 0
+        self.total = 0.0  # Seconds
+        self.max = 0.0
+
+    def __bucket(self, us):
+        shift = max(0, us.bit_length() - self.__bits - 1)
+        return (shift << self.__bits) + (us >> shift)
+
+    def __highest(self, bucket):
+        """
+        Largest value (microseconds) counted in the bucket
+        """
+        shift = max(0, (bucket >> self.__bits) - 1)
+        return ((bucket - (shift << self.__bits) + 1) << shift) - 1
+
+    def record(self, seconds):
+        bucket = self.__bucket(int(seconds * 1e6))
+        with self.__lock:
+            if bucket >= len(self.__counts):
+                self.__counts.extend([0] * (bucket + 1 - len(self.__counts)))
+            self.__counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, p):
+        """
+        :param p: float, 0..100
+        :return: float, seconds, p percent of the values are not greater
+        """
+        with self.__lock:
+            rank = p / 100.0 * self.count
+            seen = 0
+            for bucket, n in enumerate(self.__counts):
+                seen += n
+                if n and seen >= rank:
+                    return min(self.__highest(bucket) / 1e6, self.max)
+            return self.max
+
+    def summary(self):
+        """
+        :return: dict, number of values, mean, percentiles and max in milliseconds
+        """
+        r = dict(('p%s_ms' % str(p).replace('.', '_'), self.percentile(p) * 1000) for p in self.PERCENTILES)
+        with self.__lock:
+            r.update({'count': self.count,
+                      'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+                      'max_ms': self.max * 1000})
+        return r
+
+
+class TimedLock(object):
+    """
+    Lock that measures how long it is waited for and how long it is held.
+    Works under Condition as well: the time spent in wait() is not held
+    """
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__owner = None
+        self.__acquired = 0.0
+        self.wait = LatencyHistogram()
+        self.hold = LatencyHistogram()
+
+    def acquire(self, blocking=1):
+        start = time.time()
+        r = self.__lock.acquire(blocking)
+        if r:
+            self.__acquired = time.time()
+            self.__owner = get_ident()
+            self.wait.record(self.__acquired - start)
+        return r
+
+    def release(self):
+        self.hold.record(time.time() - self.__acquired)
+        self.__owner = None
+        self.__lock.release()
+
+    def _is_owned(self):
+        # Condition asks it on notify, default check would count as acquisition
+        return self.__owner == get_ident()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        return {'wait': self.wait.summary(), 'hold': self.hold.summary()}
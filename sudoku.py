@@ -1,9 +1,444 @@
-import edsudoku
+from threading import Thread, Condition
+from collections import deque
+import logging
+import random
+import time
+
+try:
+    import edsudoku
+except ImportError:
+    # Only needed for get_edsudoku, the built-in engine has no dependencies
+    edsudoku = None
+
+from protocol import DEFAULT_POOL_SIZE, DEFAULT_POOL_COMPLEXITIES
+
+
+class Board(object):
+    """
+    Sudoku board of 81 cells kept in a flat bytearray, 0 marks an empty cell.
+    Cells are indexed either flat, board[i], or by position, board[row, col]
+    """
+    __slots__ = ('cells',)
+
+    SIZE = 9
+    CELLS = SIZE * SIZE
+
+    def __init__(self, cells=None):
+        if cells is None:
+            self.cells = bytearray(self.CELLS)
+        else:
+            self.cells = bytearray(cells)
+            if len(self.cells) != self.CELLS:
+                raise ValueError('Board needs %d cells, %d given' % (self.CELLS, len(self.cells)))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        :param rows: list of 9 lists of 9 ints
+        :return: Board
+        """
+        return cls(v for row in rows for v in row)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.cells[key[0] * self.SIZE + key[1]]
+        return self.cells[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, tuple):
+            self.cells[key[0] * self.SIZE + key[1]] = value
+        else:
+            self.cells[key] = value
+
+    def __len__(self):
+        return self.CELLS
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def __eq__(self, other):
+        return isinstance(other, Board) and self.cells == other.cells
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getstate__(self):
+        return str(self.cells)
+
+    def __setstate__(self, state):
+        self.cells = bytearray(state)
+
+    def __repr__(self):
+        return 'Board(%r)' % str(self.cells)
+
+    def view(self):
+        """
+        :return: memoryview on cells, no copy is made
+        """
+        return memoryview(self.cells)
+
+    def tobytes(self):
+        return str(self.cells)
+
+    def copy(self):
+        return Board(self.cells)
+
+    def diff(self, other):
+        """
+        Cells where other differs from this board
+        :param other: Board (or 81 ints)
+        :return: list of (index, value in other)
+        """
+        new = other.cells if isinstance(other, Board) else bytearray(other)
+        old = self.cells
+        if old == new:
+            return []
+        changed = []
+        # Compare row by row, most rows are equal
+        for start in range(0, self.CELLS, self.SIZE):
+            end = start + self.SIZE
+            if old[start:end] != new[start:end]:
+                changed.extend((i, new[i]) for i in range(start, end) if old[i] != new[i])
+        return changed
+
+    def rows(self):
+        """
+        :return: list of 9 lists of 9 ints
+        """
+        return [list(self.cells[r:r + self.SIZE]) for r in range(0, self.CELLS, self.SIZE)]
+
+
+# Solver/generator engine ------------------------------------------------------
+# Candidates of a cell are kept as a bitmask, bit v set means digit v is possible
+ALL_DIGITS = 0x3FE  # Bits 1..9
+BITS = dict((1 << v, v) for v in range(1, 10))
+
+MIN_COMPLEXITY = 1
+MAX_COMPLEXITY = 10
+# Clues left in the puzzle for the easiest and the hardest complexity
+MAX_CLUES = 50
+MIN_CLUES = 22
+
+ROW_OF = [i // 9 for i in range(81)]
+COL_OF = [i % 9 for i in range(81)]
+BOX_OF = [i // 27 * 3 + i % 9 // 3 for i in range(81)]
+UNITS = ([[r * 9 + c for c in range(9)] for r in range(9)] +
+         [[r * 9 + c for r in range(9)] for c in range(9)] +
+         [[i for i in range(81) if BOX_OF[i] == b] for b in range(9)])
+
+
+def _bits(mask):
+    """
+    Digits of the candidate mask
+    """
+    return [v for v in range(1, 10) if mask & (1 << v)]
+
+
+class _Grid(object):
+    """
+    Search state: cells and digits used in every row, column and box
+    """
+    __slots__ = ('cells', 'rows', 'cols', 'boxes')
+
+    def copy(self):
+        g = _Grid()
+        g.cells = self.cells[:]
+        g.rows = self.rows[:]
+        g.cols = self.cols[:]
+        g.boxes = self.boxes[:]
+        return g
+
+    def place(self, i, v):
+        b = 1 << v
+        self.cells[i] = v
+        self.rows[ROW_OF[i]] |= b
+        self.cols[COL_OF[i]] |= b
+        self.boxes[BOX_OF[i]] |= b
+
+    def candidates(self, i):
+        return ALL_DIGITS & ~(self.rows[ROW_OF[i]] | self.cols[COL_OF[i]] | self.boxes[BOX_OF[i]])
+
+    def propagate(self):
+        """
+        Place naked singles (one candidate in a cell) and hidden singles
+        (digit fits one cell of a unit) until there are none left
+        :return: dict, cell: candidates of the remaining empty cells, None on contradiction
+        """
+        cells = self.cells
+        while True:
+            cands = {}
+            placed = False
+            for i in range(81):
+                if not cells[i]:
+                    m = self.candidates(i)
+                    if not m:
+                        return None
+                    if m in BITS:
+                        if not self.candidates(i) & m:
+                            return None
+                        self.place(i, BITS[m])
+                        placed = True
+                    else:
+                        cands[i] = m
+            if placed:
+                continue
+            for unit in UNITS:
+                once, more, used = 0, 0, 0
+                for i in unit:
+                    if cells[i]:
+                        used |= 1 << cells[i]
+                    else:
+                        m = cands[i]
+                        more |= once & m
+                        once |= m
+                if (once | used) != ALL_DIGITS:
+                    return None
+                # Candidates can be stale within the pass, skip digits placed meanwhile
+                hidden = once & ~more & ~used
+                if hidden:
+                    for i in unit:
+                        if not cells[i] and cands[i] & hidden:
+                            m = cands[i] & hidden
+                            if m not in BITS or not self.candidates(i) & m:
+                                return None
+                            self.place(i, BITS[m])
+                            placed = True
+            if not placed:
+                return cands
+
+
+def _grid(cells):
+    """
+    Build search state from 81 cells, None if the clues contradict each other
+    """
+    g = _Grid()
+    g.cells = [0] * 81
+    g.rows, g.cols, g.boxes = [0] * 9, [0] * 9, [0] * 9
+    for i, v in enumerate(cells):
+        if v:
+            if not g.candidates(i) & (1 << v):
+                return None
+            g.place(i, v)
+    return g
+
+
+def _search(grid, solutions, limit, rng=None):
+    """
+    Depth-first search with propagation, branching on the cell with the fewest candidates
+    :param solutions: list to collect solved cells into, up to limit
+    :param rng: random.Random to shuffle branches with, None - fixed order
+    """
+    cands = grid.propagate()
+    if cands is None:
+        return
+    if not cands:
+        solutions.append(grid.cells)
+        return
+    i = min(cands, key=lambda c: bin(cands[c]).count('1'))
+    digits = _bits(cands[i])
+    if rng is not None:
+        rng.shuffle(digits)
+    for v in digits:
+        g = grid.copy()
+        g.place(i, v)
+        _search(g, solutions, limit, rng)
+        if len(solutions) >= limit:
+            return
+
+
+def solve(board):
+    """
+    Solve sudoku
+    :param board: Board (or 81 ints), 0 - empty cell
+    :return: solved Board, None if there is no solution
+    """
+    grid = _grid(board)
+    if grid is None:
+        return None
+    solutions = []
+    _search(grid, solutions, 1)
+    return Board(solutions[0]) if solutions else None
+
+
+def count_solutions(board, limit=2):
+    """
+    Count solutions of sudoku, stops at limit
+    :return: int, 0..limit
+    """
+    grid = _grid(board)
+    if grid is None:
+        return 0
+    solutions = []
+    _search(grid, solutions, limit)
+    return len(solutions)
+
+
+def clamp_complexity(complexity):
+    """
+    Complexity brought to MIN_COMPLEXITY..MAX_COMPLEXITY
+    """
+    return max(MIN_COMPLEXITY, min(MAX_COMPLEXITY, int(complexity)))
+
+
+def target_clues(complexity):
+    """
+    Clues to leave in the puzzle, complexity is clamped to MIN_COMPLEXITY..MAX_COMPLEXITY
+    """
+    complexity = clamp_complexity(complexity)
+    step = float(MAX_CLUES - MIN_CLUES) / (MAX_COMPLEXITY - MIN_COMPLEXITY)
+    return int(round(MAX_CLUES - (complexity - MIN_COMPLEXITY) * step))
+
+
+def generate(complexity=5, rng=None):
+    """
+    Generate sudoku with unique solution: fill random board, then remove clues
+    in random order while the solution stays unique, until the number of clues
+    for the complexity is reached (or no clue can be removed anymore)
+    :param complexity: int, 1 (easy) .. 10 (hard)
+    :param rng: random.Random, module random by default
+    :return: dict, {'s': solved Board, 'u': unsolved Board}
+    """
+    rng = rng or random
+    solutions = []
+    _search(_grid([0] * 81), solutions, 1, rng)
+    solved = solutions[0]
+    puzzle = solved[:]
+    clues = 81
+    target = target_clues(complexity)
+    order = range(81)
+    rng.shuffle(order)
+    for i in order:
+        if clues <= target:
+            break
+        v, puzzle[i] = puzzle[i], 0
+        if count_solutions(puzzle, 2) != 1:
+            puzzle[i] = v
+        else:
+            clues -= 1
+    return {'s': Board(solved), 'u': Board(puzzle)}
 
 
 def get_sudoku(complexity=5):
+    return generate(complexity)
+
+
+def get_edsudoku(complexity=5):
+    """
+    Generate sudoku with edsudoku (ignores complexity)
+    """
     puzzle = edsudoku.generate(3, 3)
-    solved = [[int(puzzle.solution[row, col]) for col in range(puzzle.cols)] for row in range(puzzle.rows)]
-    unsolved = [[int(puzzle.problem[row, col]) if puzzle.problem[row, col] != ' ' else 0
-                 for col in range(puzzle.cols)] for row in range(puzzle.rows)]
+    solved = Board(int(puzzle.solution[row, col]) for row in range(puzzle.rows) for col in range(puzzle.cols))
+    unsolved = Board(int(puzzle.problem[row, col]) if puzzle.problem[row, col] != ' ' else 0
+                     for row in range(puzzle.rows) for col in range(puzzle.cols))
     return {'s': solved, 'u': unsolved}
+
+
+class PuzzlePool(object):
+    """
+    Pre-generated puzzles ready to be played.
+    Background producer keeps up to `size` puzzles for every complexity
+    requested so far, get() only pops one unless the pool ran dry
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, complexities=DEFAULT_POOL_COMPLEXITIES, generate=None):
+        self.size = size
+        self.__generate = generate or get_sudoku
+        self.__cond = Condition()
+        self.__puzzles = dict((c, deque()) for c in complexities)
+        self.__running = False
+        self.__producer = None
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_time = 0.0  # Total seconds spent generating in background
+        self.refill_time_max = 0.0
+
+    def start(self):
+        with self.__cond:
+            if self.__running:
+                return
+            self.__running = True
+        self.__producer = Thread(name='PuzzlePoolThread', target=self.__produce_loop)
+        self.__producer.daemon = True
+        self.__producer.start()
+
+    def stop(self):
+        with self.__cond:
+            self.__running = False
+            self.__cond.notifyAll()
+
+    def __next_to_refill(self):
+        """
+        Complexity with the fewest ready puzzles, None if all are full
+        """
+        missing = [(len(q), c) for c, q in self.__puzzles.items() if len(q) < self.size]
+        return min(missing)[1] if missing else None
+
+    def __produce_loop(self):
+        logging.info('Falling to puzzle pool loop ...')
+        while True:
+            with self.__cond:
+                complexity = self.__next_to_refill()
+                while self.__running and complexity is None:
+                    self.__cond.wait()
+                    complexity = self.__next_to_refill()
+                if not self.__running:
+                    return
+            start = time.time()
+            try:
+                puzzle = self.__generate(complexity)
+            except Exception as e:
+                logging.error('Puzzle generation failed: %s' % e)
+                time.sleep(1)
+                continue
+            elapsed = time.time() - start
+            with self.__cond:
+                self.refills += 1
+                self.refill_time += elapsed
+                self.refill_time_max = max(self.refill_time_max, elapsed)
+                self.__puzzles[complexity].append(puzzle)
+
+    def get(self, complexity):
+        """
+        Pop a ready puzzle, generate it on the spot if there is none
+        :param complexity: int, clamped to MIN_COMPLEXITY..MAX_COMPLEXITY, so
+                           the pool never keeps more than that many complexities
+        :return: dict, {'s': solved Board, 'u': unsolved Board}
+        """
+        complexity = clamp_complexity(complexity)
+        with self.__cond:
+            puzzles = self.__puzzles.setdefault(complexity, deque())
+            puzzle = puzzles.popleft() if puzzles else None
+            if puzzle is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            # Wake up producer to refill
+            self.__cond.notifyAll()
+        if puzzle is None:
+            puzzle = self.__generate(complexity)
+        return puzzle
+
+    def put(self, complexity, puzzle):
+        """
+        Return unused puzzle to the pool
+        """
+        complexity = clamp_complexity(complexity)
+        with self.__cond:
+            puzzles = self.__puzzles.setdefault(complexity, deque())
+            if len(puzzles) < self.size:
+                puzzles.append(puzzle)
+
+    def stats(self):
+        """
+        :return: dict, hit/miss counts, ready puzzles per complexity, refill latency in seconds
+        """
+        with self.__cond:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'ready': dict((str(c), len(q)) for c, q in self.__puzzles.items()),
+                    'refills': self.refills,
+                    'refill_latency_avg': self.refill_time / self.refills if self.refills else 0.0,
+                    'refill_latency_max': self.refill_time_max}
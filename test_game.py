@@ -0,0 +1,98 @@
+"""
+Game state kept up to date on every guess
+Run: python -m unittest discover -p 'test_*.py'
+"""
+import logging
+import unittest
+
+from protocol import *
+import server as s
+import sudoku as su
+
+logging.disable(logging.INFO)
+
+TEST_PORT = 17879
+
+
+def rescan(board):
+    """
+    Progress counted from the board the slow way, the way get_progress reports it
+    """
+    rows, cols, boxes = [0] * 9, [0] * 9, [0] * 9
+    for i, v in enumerate(board):
+        r, c = divmod(i, 9)
+        if v:
+            rows[r] += 1
+            cols[c] += 1
+            boxes[r // 3 * 3 + c // 3] += 1
+    return {'cells_left': sum(1 for v in board if not v),
+            'rows': rows, 'cols': cols, 'boxes': boxes,
+            'units_done': sum(1 for n in rows + cols + boxes if n == 9)}
+
+
+class GameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.game = s.Game()
+        self.game.set_broadcast_port(TEST_PORT)
+        self.game.check_name('player')
+        self.assertTrue(self.game.set_new_sudoku('player', 5))
+
+    def board(self):
+        return bytearray(self.game.get_current_state()[0].data)
+
+    def test_bad_positions(self):
+        board = self.board()
+        solution = su.solve(board)
+        empty = [i for i, v in enumerate(board) if not v]
+        # Right digit of an empty cell, put outside of the board
+        right = solution[empty[0]]
+        for pos in ([0, 9], [9, 0], [0, -1], [-1, 0], [0, 255], [0, '1'], [0.5, 0]):
+            self.assertRaises(ValueError, self.game.guess_number, right, pos, 'player')
+        for guess in ([right, 0, 9], [right, -1, 0], ['1', 0, 0]):
+            self.assertRaises(ValueError, self.game.guess_numbers, [guess], 'player')
+        self.assertEqual(self.board(), board)
+        self.assertEqual(self.game.get_progress(), rescan(board))
+
+    def test_batch_too_large(self):
+        board = self.board()
+        i = list(board).index(0)
+        guesses = [[su.solve(board)[i], i // 9, i % 9]] * (MAX_GUESS_BATCH + 1)
+        self.assertRaises(ValueError, self.game.guess_numbers, guesses, 'player')
+        self.assertEqual(self.board(), board)
+        self.assertEqual(len(self.game.guess_numbers(guesses[:MAX_GUESS_BATCH], 'player')['results']),
+                         MAX_GUESS_BATCH)
+
+    def test_progress_follows_guesses(self):
+        board = self.board()
+        solution = su.solve(board)
+        empty = [i for i, v in enumerate(board) if not v]
+        for i in empty[:-1]:
+            r, c = divmod(i, 9)
+            self.assertFalse(self.game.guess_number(solution[i] % 9 + 1, [r, c], 'player'))
+            self.assertTrue(self.game.guess_number(solution[i], [r, c], 'player'))
+            self.assertEqual(self.game.get_progress(), rescan(self.board()))
+        # Last cell solves the board
+        r, c = divmod(empty[-1], 9)
+        self.assertTrue(self.game.guess_number(solution[empty[-1]], [r, c], 'player'))
+        self.assertEqual(self.game.get_progress()['cells_left'], 0)
+        self.assertEqual(self.game.get_current_state()[0].data, '')
+
+    def test_leaderboard(self):
+        board = self.board()
+        solution = su.solve(board)
+        i = list(board).index(0)
+        r, c = divmod(i, 9)
+        for name in ('bob', 'alice', 'carol'):
+            self.game.check_name(name)
+        self.game.guess_number(solution[i] % 9 + 1, [r, c], 'bob')
+        self.game.guess_number(solution[i], [r, c], 'carol')
+        self.assertEqual(self.game.get_top(2), [['carol', 1], ['alice', 0]])
+        self.assertEqual(self.game.get_top(10), [['carol', 1], ['alice', 0], ['player', 0], ['bob', -1]])
+        self.assertEqual(self.game.get_rank('bob'), [4, -1])
+        self.assertEqual(self.game.get_rank('nobody'), [0, 0])
+        self.assertEqual(self.game.get_current_state()[1], {'player': 0, 'bob': -1, 'alice': 0, 'carol': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Long polling: many parked waiters are all woken up by one state change,
+or by closing their room
+Run: python -m unittest discover -p 'test_*.py'
+"""
+import logging
+import threading
+import time
+import unittest
+from xmlrpclib import ServerProxy, Fault
+
+from protocol import *
+from harness import start_server, stop_server
+import server as s
+
+logging.disable(logging.INFO)
+
+TEST_PORT = 17877
+WAITERS = 50
+# Waiters would come back on their own after this, well after the change
+WAIT_TIMEOUT = 20
+# All of them should be back this soon after the change
+WAKE_TIMEOUT = 5
+
+
+def park(wait, since_version, results, i):
+    results[i] = wait(since_version)
+
+
+class LongPollTest(unittest.TestCase):
+
+    def start_waiters(self, wait, since_version):
+        results = [None] * WAITERS
+        threads = [threading.Thread(target=park, args=(wait, since_version, results, i)) for i in range(WAITERS)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        return threads, results
+
+    def check_woken(self, threads, results, version):
+        deadline = time.time() + WAKE_TIMEOUT
+        for t in threads:
+            t.join(max(0, deadline - time.time()))
+        self.assertFalse(any(t.is_alive() for t in threads), 'waiters were not woken up')
+        self.assertEqual([r['version'] for r in results], [version] * WAITERS)
+        self.assertTrue(all(r['modified'] for r in results))
+
+    def wait_parked(self, parked):
+        deadline = time.time() + WAKE_TIMEOUT
+        while time.time() < deadline and parked() < WAITERS:
+            time.sleep(0.01)
+        self.assertEqual(parked(), WAITERS)
+
+    def test_game_waiters(self):
+        game = s.Game()
+        game.set_broadcast_port(TEST_PORT + 1)
+        version = game.get_changes(-1)['version']
+        threads, results = self.start_waiters(lambda v: game.wait_for_update(v, WAIT_TIMEOUT), version)
+        # Nobody comes back before the change
+        time.sleep(0.2)
+        self.assertTrue(all(t.is_alive() for t in threads))
+        game.check_name('player')
+        self.check_woken(threads, results, version + 1)
+
+    def test_rpc_waiters(self):
+        server = start_server(TEST_PORT, DEFAULT_RPC_WORKERS)
+        try:
+            url = 'http://127.0.0.1:%d' % TEST_PORT
+            version = ServerProxy(url).get_changes(DEFAULT_ROOM, -1)['version']
+            threads, results = self.start_waiters(
+                lambda v: ServerProxy(url).wait_for_update(DEFAULT_ROOM, v, WAIT_TIMEOUT), version)
+            # More waiters than workers, all of them park without stalling the pool
+            self.wait_parked(lambda: server.server.parked_workers()[1])
+            self.assertTrue(ServerProxy(url).check_name(DEFAULT_ROOM, 'player'))
+            self.check_woken(threads, results, version + 1)
+        finally:
+            stop_server(server)
+
+    def test_closed_room_wakes_waiters(self):
+        server = start_server(TEST_PORT, DEFAULT_RPC_WORKERS)
+        try:
+            url = 'http://127.0.0.1:%d' % TEST_PORT
+            self.assertTrue(ServerProxy(url).create_room('closing'))
+            version = ServerProxy(url).get_changes('closing', -1)['version']
+
+            def wait(v):
+                try:
+                    return ServerProxy(url).wait_for_update('closing', v, WAIT_TIMEOUT)
+                except Fault as e:
+                    return e
+            threads, results = self.start_waiters(wait, version)
+            self.wait_parked(lambda: server.server.parked_workers()[1])
+            self.assertTrue(ServerProxy(url).close_room('closing'))
+            deadline = time.time() + WAKE_TIMEOUT
+            for t in threads:
+                t.join(max(0, deadline - time.time()))
+            self.assertFalse(any(t.is_alive() for t in threads), 'waiters were not woken up')
+            self.assertTrue(all(isinstance(r, Fault) for r in results))
+        finally:
+            stop_server(server)
+
+    def test_room_limits(self):
+        rooms = s.RoomRegistry(max_rooms=3)
+        rooms.add_room(s.Game())
+        self.assertFalse(rooms.close_room(DEFAULT_ROOM))
+        self.assertFalse(rooms.create_room('x' * (MAX_ROOM_ID_LENGTH + 1)))
+        self.assertTrue(rooms.create_room('a'))
+        self.assertTrue(rooms.create_room('b'))
+        self.assertFalse(rooms.create_room('c'))
+        self.assertEqual(rooms.list_rooms(), sorted([DEFAULT_ROOM, 'a', 'b']))
+
+
+if __name__ == '__main__':
+    unittest.main()
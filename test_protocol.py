@@ -0,0 +1,73 @@
+"""
+Round trip of the session message codec
+Run: python -m unittest discover -p 'test_*.py'
+"""
+import unittest
+
+from protocol import *
+from sudoku import Board
+
+
+BOARD = Board([(i * 7) % 10 for i in range(BOARD_CELLS)])
+SCORES = [[u'player%d' % i, 10 * i - 5] for i in range(DEFAULT_LEADERBOARD_SIZE)]
+
+# Message code: (value, value expected back)
+SAMPLES = {
+    REQ_GM_SET_NAME: (u'pl\xe4yer', u'pl\xe4yer'),
+    REQ_GM_SET_SUDOKU: (5, 5),
+    REQ_GM_GUESS: ((7, 4, 8), (7, 4, 8)),
+    REQ_GM_GET_STATE: (None, None),
+    RSP_GM_STATE: ((BOARD, SCORES), (BOARD.cells, SCORES)),
+    RSP_GM_NOTIFY: (u'player2 guessed 7 on [4][8] \u2713', u'player2 guessed 7 on [4][8] \u2713'),
+}
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_every_message_has_sample(self):
+        self.assertEqual(sorted(SAMPLES), sorted(CODECS))
+
+    def test_round_trip(self):
+        for kind, (value, expected) in SAMPLES.items():
+            self.assertEqual(deserialize(kind, serialize(kind, value)), expected, kind)
+
+    def test_state_from_dict_and_empty_table(self):
+        board, table = deserialize(RSP_GM_STATE, serialize(RSP_GM_STATE, (BOARD, {u'bob': -3})))
+        self.assertEqual(table, [[u'bob', -3]])
+        board, table = deserialize(RSP_GM_STATE, serialize(RSP_GM_STATE, (bytearray(BOARD_CELLS), [])))
+        self.assertEqual((board, table), (bytearray(BOARD_CELLS), []))
+
+    def test_truncated(self):
+        for kind, (value, _) in SAMPLES.items():
+            payload = serialize(kind, value)
+            for n in range(len(payload)):
+                self.assertRaises(ValueError, deserialize, kind, payload[:n])
+
+    def test_extra_bytes(self):
+        for kind, (value, _) in SAMPLES.items():
+            self.assertRaises(ValueError, deserialize, kind, serialize(kind, value) + '\0')
+
+    def test_other_version(self):
+        for kind, (value, _) in SAMPLES.items():
+            payload = serialize(kind, value)
+            self.assertRaises(ValueError, deserialize, kind, chr(CODEC_VERSION + 1) + payload[1:])
+
+    def test_broken_text(self):
+        payload = serialize(REQ_GM_SET_NAME, u'ab')
+        self.assertRaises(ValueError, deserialize, REQ_GM_SET_NAME, payload[:-1] + '\xff')
+
+    def test_broken_board(self):
+        payload = bytearray(serialize(RSP_GM_STATE, (BOARD, SCORES)))
+        payload[CODEC_HEADER.size] = 0xf0  # Cell 15
+        self.assertRaises(ValueError, deserialize, RSP_GM_STATE, str(payload))
+
+    def test_value_does_not_fit(self):
+        self.assertRaises(ValueError, serialize, REQ_GM_GUESS, (256, 0, 0))
+        self.assertRaises(ValueError, serialize, REQ_GM_SET_SUDOKU, -1)
+        self.assertRaises(ValueError, serialize, REQ_GM_SET_NAME, u'x' * 256)
+        self.assertRaises(ValueError, serialize, RSP_GM_STATE, ([0] * 80, []))
+        self.assertRaises(ValueError, serialize, RSP_GM_STATE, ([16] + [0] * 80, []))
+
+
+if __name__ == '__main__':
+    unittest.main()